@@ -1,10 +1,96 @@
+from django import forms
+from django.conf import settings
 from django.contrib import admin
+from django.contrib.admin.views.main import PAGE_VAR
+from django.contrib.admin.widgets import AutocompleteSelect
+from django.utils.text import Truncator
 
 from .models import Comment, Follow, Group, Post
+from .paginator import CappedPaginator
+from .search import filter_posts
 
 EMPTY = '-пусто-'
 
 
+class AutocompleteFilter(admin.FieldListFilter):
+    """Filter by the related object chosen in the autocomplete select.
+
+    The sidebar lists no related objects at all, they are searched by the
+    admin of the related model while the name is typed.
+    """
+
+    template = 'admin/autocomplete_filter.html'
+
+    def __init__(self, field, request, params, model, model_admin,
+                 field_path):
+        self.lookup_kwarg = f'{field_path}__{field.target_field.name}__exact'
+        super().__init__(
+            field, request, params, model, model_admin, field_path)
+        self.formfield = field.formfield(
+            widget=AutocompleteSelect(field, model_admin.admin_site),
+            required=False,
+        )
+        try:
+            self.value = self.formfield.clean(
+                self.used_parameters.get(self.lookup_kwarg))
+        except forms.ValidationError:
+            self.value = None
+        # The other filters of the page are kept by the form.
+        self.hidden = [
+            (name, value) for name, value in request.GET.items()
+            if name not in (self.lookup_kwarg, PAGE_VAR)
+        ]
+
+    def widget(self):
+        return self.formfield.widget.render(
+            self.lookup_kwarg,
+            self.value.pk if self.value else None,
+            attrs={'style': 'width: 100%'},
+        )
+
+    def has_output(self):
+        return True
+
+    def expected_parameters(self):
+        return [self.lookup_kwarg]
+
+    def choices(self, changelist):
+        yield {
+            'selected': self.value is None,
+            'query_string': changelist.get_query_string(
+                remove=[self.lookup_kwarg]),
+            'display': 'Все',
+        }
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """Admin of the tables of millions of rows.
+
+    The change list neither counts all rows nor lists all related objects:
+    the paginator counts up to settings.ADMIN_COUNT_LIMIT rows, the related
+    objects are selected by the join and filtered by AutocompleteFilter.
+    The text column is cut to settings.ADMIN_TEXT_LENGTH.
+    """
+
+    paginator = CappedPaginator
+    show_full_result_count = False
+
+    @property
+    def media(self):
+        # The select2 of the autocomplete filters.
+        return super().media + AutocompleteSelect(None, self.admin_site).media
+
+    def get_list_display(self, request):
+        return tuple(
+            'short_text' if name == 'text' else name
+            for name in super().get_list_display(request)
+        )
+
+    @admin.display(description='Текст')
+    def short_text(self, obj):
+        return Truncator(obj.text).chars(settings.ADMIN_TEXT_LENGTH)
+
+
 class GroupAdmin(admin.ModelAdmin):
     prepopulated_fields = {'slug': ('title',)}
     list_display = ('pk', 'title', 'slug', 'description')
@@ -12,22 +98,42 @@ class GroupAdmin(admin.ModelAdmin):
     empty_value_display = EMPTY
 
 
-class PostAdmin(admin.ModelAdmin):
+class PostAdmin(LargeTableAdmin):
     list_display = ('pk', 'text', 'pub_date', 'author', 'group', 'image')
+    list_select_related = ('author', 'group')
     search_fields = ('text',)
-    list_filter = ('pub_date', 'group')
+    list_filter = (
+        'pub_date',
+        ('author', AutocompleteFilter),
+        ('group', AutocompleteFilter),
+    )
+    autocomplete_fields = ('author', 'group')
     empty_value_display = EMPTY
 
+    def get_search_results(self, request, queryset, search_term):
+        # The text is searched by the index of posts.search, not LIKE.
+        if not search_term:
+            return queryset, False
+        return filter_posts(queryset, search_term), False
+
 
-class CommentAdmin(admin.ModelAdmin):
-    list_display = ('pk', 'text', 'created', 'author')
+class CommentAdmin(LargeTableAdmin):
+    list_display = ('pk', 'text', 'created', 'author', 'post')
+    list_select_related = ('author', 'post')
     search_fields = ('text',)
-    list_filter = ('created', 'author')
+    list_filter = ('created', ('author', AutocompleteFilter))
+    autocomplete_fields = ('author', 'post')
+    # The comments are numbered in the order of creation, the rowid needs
+    # no index to be sorted.
+    ordering = ('-pk',)
 
 
-class FollowAdmin(admin.ModelAdmin):
+class FollowAdmin(LargeTableAdmin):
     list_display = ('pk', 'user', 'author')
+    list_select_related = ('user', 'author')
     search_fields = ('user__username', 'author__username')
+    autocomplete_fields = ('user', 'author')
+    ordering = ('-pk',)
 
 
 admin.site.register(Group, GroupAdmin)
@@ -0,0 +1,443 @@
+"""Benchmarks of the hot paths.
+
+Every scenario runs inside its own throwaway SQLite database created by
+the benchmark command, so it may insert as many rows as it wants. The
+volumes of the rows are multiplied by SCALE, see scaled().
+"""
+from contextlib import contextmanager
+from io import BytesIO
+from multiprocessing import get_context
+from pathlib import Path
+from statistics import median
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.db import (OperationalError, close_old_connections, connection,
+                       connections)
+from django.template import Context, Template
+from django.template.loader import render_to_string
+from django.test import Client, RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.views.decorators.cache import cache_page
+from django.views.decorators.vary import vary_on_cookie
+from PIL import Image
+
+from . import feeds, views
+from .cache import cache_shared_page, local
+from .cache_backend import SQLiteCache
+from .models import Comment, Follow, Group, Post, User
+from .paginator import my_paginator
+from .search import SearchResults
+from .thumbnails import make_variants
+
+SCENARIOS = {}
+# Set by 'manage.py benchmark --scale', the smoke test runs tiny volumes.
+SCALE = 1
+
+
+def scenario(func):
+    """Register the benchmark scenario under the name of the function."""
+    SCENARIOS[func.__name__] = func
+    return func
+
+
+def scaled(*volumes):
+    """Return the volumes multiplied by SCALE, at least one row each."""
+    return [volume and max(round(volume * SCALE), 1) for volume in volumes]
+
+
+@contextmanager
+def temporary_database():
+    """Switch the default database to a new migrated SQLite file."""
+    settings_dict = connections['default'].settings_dict
+    name = settings_dict['NAME']
+    with TemporaryDirectory() as directory:
+        connections.close_all()
+        settings_dict['NAME'] = str(Path(directory) / 'benchmark.sqlite3')
+        try:
+            call_command('migrate', verbosity=0)
+            yield
+        finally:
+            connections.close_all()
+            settings_dict['NAME'] = name
+
+
+def measure(func, repeat):
+    """Return median time in milliseconds and number of queries of func."""
+    timings = []
+    with CaptureQueriesContext(connection) as queries:
+        for _ in range(repeat):
+            start = perf_counter()
+            func()
+            timings.append((perf_counter() - start) * 1000)
+    return median(timings), len(queries) // repeat
+
+
+def clear_caches():
+    """Clear the shared cache and the local one of the process."""
+    cache.clear()
+    local.clear()
+
+
+def get_page(client, url, clear=True):
+    """Return function requesting the url bypassing the page cache."""
+    def request():
+        if clear:
+            clear_caches()
+        response = client.get(url)
+        assert response.status_code == 200, response.status_code
+    return request
+
+
+@scenario
+def comments(out, repeat):
+    """Latency of the main page while one post collects comments."""
+    user = User.objects.create(username='benchmark')
+    posts = Post.objects.bulk_create(
+        Post(text=f'Пост {number}', author=user) for number in range(10))
+    viral = posts[-1]
+    client = Client()
+    url = reverse('index')
+    total = 0
+    out.write(f'{"comments":>10} {"index, ms":>10} {"queries":>8} '
+              f'{"prefetch, ms":>13}')
+    for volume in scaled(0, 100, 1000, 10000, 50000):
+        Comment.objects.bulk_create(
+            (Comment(post=viral, author=user, text='Комментарий ' * 10)
+             for _ in range(volume - total)),
+            batch_size=1000,
+        )
+        total = volume
+        Post.objects.filter(pk=viral.pk).update(comment_count=total)
+        timing, queries = measure(get_page(client, url), repeat)
+        prefetch, _ = measure(
+            lambda: list(Post.objects.prefetch_related('comments')[:10]),
+            repeat,
+        )
+        out.write(f'{volume:>10} {timing:>10.2f} {queries:>8} '
+                  f'{prefetch:>13.2f}')
+
+
+@scenario
+def follow_feed(out, repeat):
+    """Latency of the follow page by every feed engine."""
+    reader = User.objects.create(username='reader')
+    client = Client()
+    client.force_login(reader)
+    url = reverse('follow_index')
+    total = 0
+    out.write(f'{"authors":>8} ' + ' '.join(
+        f'{engine + ", ms":>14} {"queries":>8}' for engine in feeds.ENGINES))
+    for authors in scaled(10, 100, 1000):
+        new_authors = User.objects.bulk_create(
+            User(username=f'author_{number}')
+            for number in range(total, authors)
+        )
+        total = authors
+        Follow.objects.bulk_create(
+            Follow(user=reader, author=author) for author in new_authors)
+        Post.objects.bulk_create(
+            (Post(text=f'Пост {number}', author=author)
+             for author in new_authors for number in range(20)),
+            batch_size=1000,
+        )
+        feeds.rebuild()
+        clear_caches()
+        row = []
+        for engine in feeds.ENGINES:
+            with override_settings(FOLLOW_FEED_ENGINE=engine):
+                client.get(url)
+                row.append(measure(get_page(client, url, False), repeat))
+        out.write(f'{authors:>8} ' + ' '.join(
+            f'{timing:>14.2f} {queries:>8}' for timing, queries in row))
+
+
+@scenario
+def page_cache(out, repeat):
+    """Hit rate of the index cache for a crowd of distinct visitors."""
+    users = User.objects.bulk_create(
+        User(username=f'visitor_{number}') for number in range(10))
+    Post.objects.bulk_create(
+        Post(text=f'Пост {number}', author=users[number % 10])
+        for number in range(10))
+    visitors = [AnonymousUser()] * 10 + users
+    factory = RequestFactory()
+    calls = []
+
+    def index(request):
+        calls.append(request)
+        return views.index.__wrapped__(request)
+
+    strategies = {
+        'vary_on_cookie': cache_page(60, key_prefix='bench_vary')(
+            vary_on_cookie(index)),
+        'shared': cache_shared_page(60, key_prefix='bench_shared')(index),
+    }
+    out.write(f'{"strategy":>15} {"requests":>9} {"hit rate":>9} '
+              f'{"ms/request":>11}')
+    for name, view in strategies.items():
+        clear_caches()
+        calls.clear()
+        requests = 0
+
+        def crowd():
+            # Every round is a new TTL window seen by each visitor once.
+            nonlocal requests
+            clear_caches()
+            for number, user in enumerate(visitors):
+                request = factory.get('/', HTTP_COOKIE=f'visitor={number}')
+                request.user = user
+                view(request)
+                requests += 1
+
+        timing, _ = measure(crowd, repeat)
+        out.write(f'{name:>15} {requests:>9} '
+                  f'{1 - len(calls) / requests:>9.2%} '
+                  f'{timing / len(visitors):>11.2f}')
+
+
+@scenario
+def post_cards(out, repeat):
+    """Latency of the profile page with cold and cached post cards."""
+    author = User.objects.create(username='author')
+    Post.objects.bulk_create(
+        Post(text=f'Пост {number}\n' * 20, author=author)
+        for number in range(10))
+    client = Client()
+    client.force_login(author)
+    url = reverse('profile', kwargs={'username': author.username})
+    cold, cold_queries = measure(get_page(client, url), repeat)
+    client.get(url)
+    warm, warm_queries = measure(get_page(client, url, False), repeat)
+    out.write(f'{"cards":>6} {"profile, ms":>12} {"queries":>8}')
+    out.write(f'{"cold":>6} {cold:>12.2f} {cold_queries:>8}')
+    out.write(f'{"cached":>6} {warm:>12.2f} {warm_queries:>8}')
+
+
+def serve_pages(backend, pages, requests, misses):
+    """Serve the requests of the worker rendering every missed page."""
+    for number in range(requests):
+        key = f'page:{number % pages}'
+        if backend.get(key) is None:
+            start = perf_counter()
+            while perf_counter() - start < 0.005:
+                pass
+            backend.set(key, 'x' * 20000, 60)
+            with misses.get_lock():
+                misses.value += 1
+
+
+@scenario
+def cache_backends(out, repeat):
+    """Hit rate and throughput of the page cache of several workers."""
+    context = get_context('fork')
+    pages, requests = 20, 100 * repeat
+    out.write(f'{"backend":>10} {"workers":>8} {"renders":>8} '
+              f'{"hit rate":>9} {"requests/s":>11}')
+    with TemporaryDirectory() as directory:
+        backends = {
+            'locmem': lambda: LocMemCache('benchmark', {}),
+            'sqlite': lambda: SQLiteCache(
+                Path(directory) / 'cache.sqlite3', {}),
+        }
+        for workers in (1, 4, 8):
+            for name, backend in backends.items():
+                backend().clear()
+                misses = context.Value('i', 0)
+                processes = [
+                    context.Process(
+                        target=serve_pages,
+                        args=(backend(), pages, requests, misses),
+                    )
+                    for _ in range(workers)
+                ]
+                start = perf_counter()
+                for process in processes:
+                    process.start()
+                for process in processes:
+                    process.join()
+                elapsed = perf_counter() - start
+                total = workers * requests
+                out.write(f'{name:>10} {workers:>8} {misses.value:>8} '
+                          f'{1 - misses.value / total:>9.2%} '
+                          f'{total / elapsed:>11.0f}')
+
+
+@scenario
+def paginator(out, repeat):
+    """Render time of the page bar by the number of pages."""
+    page_range_loop = Template(
+        '{% for i in page.paginator.page_range %}'
+        '{% if from_page <= i and to_page >= i %}{{ i }}{% endif %}'
+        '{% endfor %}'
+    )
+    out.write(f'{"pages":>8} {"page bar, ms":>13} {"page_range, ms":>15}')
+    for pages in (10, 1000, 100000):
+        context = my_paginator(range(pages * 10), pages // 2)
+        timing, _ = measure(
+            lambda: render_to_string('includes/paginator.html', context),
+            repeat,
+        )
+        loop, _ = measure(
+            lambda: page_range_loop.render(Context(context)),
+            repeat,
+        )
+        out.write(f'{pages:>8} {timing:>13.3f} {loop:>15.3f}')
+
+
+@scenario
+def search(out, repeat):
+    """Latency of the search by the index and by LIKE by the posts."""
+    # The rare word is in every thousandth post, the common one and the
+    # prefix of the words are in all of them.
+    user = User.objects.create(username='searcher')
+    words = ('кот', 'пёс', 'ёж', 'сова', 'лиса', 'заяц', 'волк', 'медведь')
+    total = 0
+    out.write(f'{"posts":>8} {"search, ms":>11} {"count, ms":>10} '
+              f'{"common, ms":>11} {"prefix, ms":>11} {"LIKE count, ms":>15}')
+    for volume in scaled(1000, 10000, 100000, 300000):
+        # Every thousandth post mentions the rare word.
+        Post.objects.bulk_create(
+            (Post(
+                text=' '.join(words[(number + shift) % len(words)]
+                              for shift in range(20))
+                + (' енот' if number % 1000 == 0 else ''),
+                author=user,
+            ) for number in range(total, volume)),
+            batch_size=1000,
+        )
+        total = volume
+        results = SearchResults('енот')
+        timing, _ = measure(lambda: results[0:10], repeat)
+        count, _ = measure(results.count, repeat)
+        common, _ = measure(lambda: SearchResults('кот')[0:10], repeat)
+        prefix, _ = measure(lambda: SearchResults('м')[0:10], repeat)
+        # The admin counts the results of LIKE by the full scan.
+        like, _ = measure(
+            Post.objects.filter(text__icontains='енот').count, repeat)
+        out.write(f'{volume:>8} {timing:>11.2f} {count:>10.2f} '
+                  f'{common:>11.2f} {prefix:>11.2f} {like:>15.2f}')
+
+
+@scenario
+def image_variants(out, repeat):
+    """Bytes of every variant of the card image of a photo."""
+    photo = Image.effect_mandelbrot((2400, 1600), (-2, -1.2, 1, 1.2), 100)
+    buffer = BytesIO()
+    photo.convert('RGB').save(buffer, 'JPEG', quality=95)
+    with TemporaryDirectory() as directory, override_settings(
+            MEDIA_ROOT=directory):
+        name = default_storage.save('posts/photo.jpg', ContentFile(
+            buffer.getvalue()))
+        start = perf_counter()
+        variants = make_variants(name)
+        making = (perf_counter() - start) * 1000
+        # The thumbnails are made, only their metadata is collected again.
+        timing, _ = measure(lambda: make_variants(name), repeat)
+        baseline = default_storage.size(variants['jpeg'][1][0])
+        out.write(f'{"format":>7} {"width":>6} {"bytes":>8} '
+                  f'{"of 960 jpeg":>12}')
+        for image_format, images in variants.items():
+            for image, width, _ in images:
+                size = default_storage.size(image)
+                out.write(f'{image_format:>7} {width:>6} {size:>8} '
+                          f'{size / baseline:>12.0%}')
+    out.write(f'Making of all variants: {making:.2f} ms')
+    out.write(f'Metadata of the made variants: {timing:.2f} ms')
+
+
+def serve_mixed_load(cookies, reads, comment_url, requests, served, failed):
+    """Serve the requests of the worker, every fifth of them a comment."""
+    client = Client()
+    client.cookies = cookies
+    for number in range(requests):
+        # Like a server does; the test client leaves the connection open.
+        close_old_connections()
+        try:
+            if number % 5 == 4:
+                response = client.post(
+                    comment_url, {'text': f'Комментарий {number}'})
+            else:
+                response = client.get(reads[number % len(reads)])
+            ok = response.status_code in (200, 302)
+        except OperationalError:
+            ok = False
+        counter = served if ok else failed
+        with counter.get_lock():
+            counter.value += 1
+    connections.close_all()
+
+
+@scenario
+def sqlite_load(out, repeat):
+    """Throughput of the posts views under the mixed load of workers."""
+    context = get_context('fork')
+    author = User.objects.create(username='load_author')
+    group = Group.objects.create(title='Нагрузка', slug='load')
+    posts = Post.objects.bulk_create(
+        Post(text=f'Пост {number}', author=author, group=group)
+        for number in range(30))
+    reads = [
+        reverse('index'),
+        reverse('group', kwargs={'slug': group.slug}),
+        reverse('profile', kwargs={'username': author.username}),
+        reverse('post', kwargs={
+            'username': author.username, 'post_id': posts[0].pk}),
+    ]
+    comment_url = reverse('add_comment', kwargs={
+        'username': author.username, 'post_id': posts[0].pk})
+    client = Client()
+    client.force_login(author)
+    # The journal mode is set on the file before the workers start.
+    profiles = {
+        'default': ('DELETE', {}, 0, [
+            name for name in settings.MIDDLEWARE
+            if name != 'posts.middleware.write_lock'
+        ]),
+        'tuned': ('WAL', settings.SQLITE_PRAGMAS, 600, settings.MIDDLEWARE),
+    }
+    settings_dict = connections['default'].settings_dict
+    conn_max_age = settings_dict['CONN_MAX_AGE']
+    requests = 5 * repeat
+    out.write(f'{"profile":>8} {"workers":>8} {"requests/s":>11} '
+              f'{"failed":>7}')
+    # The views hit the database on every request.
+    with override_settings(
+            CACHES={'default': {
+                'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}},
+            LOCAL_CACHE_SIZE=0):
+        for workers in (1, 4, 8):
+            for name, profile in profiles.items():
+                journal_mode, pragmas, max_age, middleware = profile
+                with connection.cursor() as cursor:
+                    cursor.execute(f'PRAGMA journal_mode = {journal_mode}')
+                connections.close_all()
+                settings_dict['CONN_MAX_AGE'] = max_age
+                served, failed = context.Value('i', 0), context.Value('i', 0)
+                with override_settings(
+                        SQLITE_PRAGMAS=pragmas, MIDDLEWARE=middleware):
+                    processes = [
+                        context.Process(target=serve_mixed_load, args=(
+                            client.cookies, reads, comment_url, requests,
+                            served, failed,
+                        ))
+                        for _ in range(workers)
+                    ]
+                    start = perf_counter()
+                    for process in processes:
+                        process.start()
+                    for process in processes:
+                        process.join()
+                    elapsed = perf_counter() - start
+                out.write(f'{name:>8} {workers:>8} '
+                          f'{served.value / elapsed:>11.0f} '
+                          f'{failed.value:>7}')
+    settings_dict['CONN_MAX_AGE'] = conn_max_age
@@ -0,0 +1,468 @@
+"""Page cache shared by all visitors.
+
+The page is rendered once with the viewer-specific parts punched out: the
+{% hole %} tag (posts.templatetags.holes) leaves a marker instead of its
+template. The body with markers is cached under a key which does not depend
+on the visitor, and the markers are filled for every request, so anonymous
+and authenticated visitors share the same cache entry.
+
+The keys include the versions of the scopes the page depends on ('feed',
+'group:<slug>', 'author:<username>', 'post:<id>'). The signals bump the
+versions on every write, so the pages are cached for hours and still
+change right after the write.
+
+The cards of the posts (includes/post_item.html) are cached one by one
+under the version of the post and its number of comments, so the same card
+is reused by all pages and visitors (see render_posts).
+
+The pages and the cards are stored under keys without versions together
+with the stamp of the versions they were built for (see single_flight).
+The entry with an old stamp is rebuilt by one request while the others
+keep getting it, so neither an expired TTL nor a write makes all the
+concurrent requests run the queries at once.
+
+The fresh entries and the versions are also kept in the memory of the
+worker (posts.local_cache). The versions are trusted for
+settings.LOCAL_VERSION_TTL seconds only, so a write made by another worker
+is seen after that time, while the common request reads nothing from the
+cache backend at all.
+
+The entries of the scopes written within settings.READ_YOUR_WRITES_TTL
+seconds are built from the primary database, since the replicas may not
+have the write yet (posts.routers), and the stale page would be cached
+under the new versions.
+"""
+import re
+from collections import Counter
+from datetime import datetime, timezone
+from functools import wraps
+from hashlib import md5
+from math import log
+from random import random
+from threading import Lock
+from time import perf_counter, sleep, time, time_ns
+from urllib.parse import parse_qsl, urlencode
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.signals import setting_changed
+from django.db import transaction
+from django.dispatch import receiver
+from django.http import HttpResponse
+from django.template.loader import render_to_string
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.views.decorators.http import condition
+
+from . import routers
+from .local_cache import LocalCache
+
+POST_CARD = 'includes/post_item.html'
+local = LocalCache(settings.LOCAL_CACHE_SIZE, settings.LOCAL_CACHE_TTL)
+# Hits and misses not yet added to the shared cache, see record.
+page_counts = Counter()
+stats_flushed = time()
+stats_lock = Lock()
+HOLE = re.compile(
+    r'<!--hole:(?P<template>includes/[\w/.-]+)\?(?P<params>[^>]*)-->')
+
+
+@receiver(setting_changed)
+def resize_local_cache(setting, **kwargs):
+    if setting in ('LOCAL_CACHE_SIZE', 'LOCAL_CACHE_TTL'):
+        local.size = settings.LOCAL_CACHE_SIZE
+        local.ttl = settings.LOCAL_CACHE_TTL
+        local.clear()
+
+
+def hole_marker(template_name, params):
+    """Return the marker which is replaced by the template on fill."""
+    return f'<!--hole:{template_name}?{urlencode(params)}-->'
+
+
+def render_hole(request, template_name, params):
+    """Render the viewer-specific template of the hole."""
+    return render_to_string(template_name, params, request=request)
+
+
+def fill_holes(content, request):
+    """Replace every marker in the content with its rendered template."""
+    return HOLE.sub(
+        lambda match: render_hole(
+            request,
+            match['template'],
+            dict(parse_qsl(match['params'], keep_blank_values=True)),
+        ),
+        content,
+    )
+
+
+def record(key_prefix, hit):
+    """Count the hit or the miss of the page cache.
+
+    The counts are kept in the memory of the worker and added to the shared
+    cache once in settings.PAGE_STATS_FLUSH_INTERVAL seconds, so the common
+    request writes nothing to the cache backend.
+    """
+    key = f'page_stats:{key_prefix}:{"hits" if hit else "misses"}'
+    with stats_lock:
+        page_counts[key] += 1
+    if time() - stats_flushed >= settings.PAGE_STATS_FLUSH_INTERVAL:
+        flush_stats()
+
+
+def flush_stats():
+    """Add the counts of the worker to the shared cache."""
+    global page_counts, stats_flushed
+    with stats_lock:
+        counts, page_counts = page_counts, Counter()
+        stats_flushed = time()
+    for key, count in counts.items():
+        if not cache.add(key, count, None):
+            try:
+                cache.incr(key, count)
+            except ValueError:
+                cache.set(key, count, None)
+
+
+def page_stats(key_prefix):
+    """Return hits, misses and the hit rate of the page cache."""
+    flush_stats()
+    hits = cache.get(f'page_stats:{key_prefix}:hits', 0)
+    misses = cache.get(f'page_stats:{key_prefix}:misses', 0)
+    total = hits + misses
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_rate': hits / total if total else 0.0,
+    }
+
+
+def version_key(scope):
+    return f'version:{scope}'
+
+
+def modified_key(scope):
+    return f'modified:{scope}'
+
+
+def get_versions(scopes):
+    """Return the versions of the scopes in the same order.
+
+    The lost version starts again from the current time in nanoseconds,
+    which is greater than any version given out before.
+    """
+    keys = [version_key(scope) for scope in scopes]
+    versions = {key: local.get(key) for key in keys}
+    missing = [key for key, version in versions.items() if version is None]
+    if missing:
+        versions.update(cache.get_many(missing))
+        for key in missing:
+            if versions[key] is None:
+                cache.add(key, time_ns(), None)
+                versions[key] = cache.get(key, 0)
+            local.set(key, versions[key], settings.LOCAL_VERSION_TTL)
+    return [versions[key] for key in keys]
+
+
+def bump(scopes):
+    """Move the scopes to the next version and remember the time."""
+    modified = time()
+    cache.set_many({modified_key(scope): modified for scope in scopes}, None)
+    for scope in scopes:
+        local.delete(modified_key(scope))
+        key = version_key(scope)
+        try:
+            local.set(
+                key, cache.incr(key), settings.LOCAL_VERSION_TTL)
+        except ValueError:
+            # Nobody has read the version yet.
+            local.delete(key)
+
+
+def invalidate(scopes):
+    """Bump the scopes now and once more after the commit.
+
+    The second bump drops the pages rendered by other requests between
+    the write and the commit, when the change was not visible to them.
+    """
+    scopes = list(scopes)
+    bump(scopes)
+    transaction.on_commit(lambda: bump(scopes))
+
+
+def last_modified(scopes):
+    """Return the time of the latest write into the scopes.
+
+    The unknown time, like after the start of the cache, is taken as now.
+    """
+    keys = [modified_key(scope) for scope in scopes]
+    times = {key: local.get(key) for key in keys}
+    missing = [key for key, moment in times.items() if moment is None]
+    if missing:
+        times.update(cache.get_many(missing))
+        for key in missing:
+            if times[key] is None:
+                cache.add(key, time(), None)
+                times[key] = cache.get(key, time())
+            local.set(key, times[key], settings.LOCAL_VERSION_TTL)
+    return datetime.fromtimestamp(max(times.values()), timezone.utc)
+
+
+def conditional_page(scopes):
+    """Answer the conditional GET of the page before running the view.
+
+    The ETag is built from the versions of the scopes and the visitor,
+    since the page shows the visitor's parts. Last-Modified is the time
+    of the latest write into the scopes and is sent to the anonymous
+    visitors only. The scopes are like in cache_shared_page.
+    """
+    def names(request, *args, **kwargs):
+        return (
+            scopes(request, *args, **kwargs) if callable(scopes) else scopes)
+
+    def etag(request, *args, **kwargs):
+        versions = get_versions(names(request, *args, **kwargs))
+        raw = f'{".".join(map(str, versions))}:{request.user.pk or 0}'
+        return md5(raw.encode()).hexdigest()
+
+    def modified(request, *args, **kwargs):
+        if request.user.is_authenticated:
+            return None
+        return last_modified(names(request, *args, **kwargs))
+
+    def decorator(view):
+        view = condition(etag_func=etag, last_modified_func=modified)(view)
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            response = view(request, *args, **kwargs)
+            patch_vary_headers(response, ('Cookie',))
+            if request.user.is_authenticated:
+                patch_cache_control(response, private=True)
+            return response
+        return wrapper
+    return decorator
+
+
+def post_scopes(post_id, username, slug=None):
+    """Return the scopes of the pages showing the post."""
+    scopes = ['feed', f'post:{post_id}', f'author:{username}']
+    if slug:
+        scopes.append(f'group:{slug}')
+    return scopes
+
+
+def is_fresh(entry, stamp):
+    """Tell whether the entry is built for the stamp and is not expiring.
+
+    With settings.CACHE_EARLY_RECOMPUTE > 0 the entry is considered
+    expired a bit earlier at random: the longer it takes to build, the
+    earlier (the XFetch algorithm), so one of the requests usually
+    rebuilds it before the TTL ends.
+    """
+    if entry is None or entry['stamp'] != stamp:
+        return False
+    early = (
+        entry['delta'] * settings.CACHE_EARLY_RECOMPUTE * -log(1 - random()))
+    return time() + early < entry['expires']
+
+
+def get_entries(keys, stamps):
+    """Return the entries of the keys, fresh ones from the local cache.
+
+    The entries missing or outdated in the local cache are read from the
+    cache backend by one get_many; the fresh ones are kept locally.
+    """
+    entries = {}
+    for key, stamp in zip(keys, stamps):
+        entry = local.get(key)
+        if is_fresh(entry, stamp):
+            entries[key] = entry
+    missing = [key for key in keys if key not in entries]
+    if missing:
+        shared = cache.get_many(missing)
+        for key, stamp in zip(keys, stamps):
+            entry = shared.get(key)
+            if entry is not None:
+                entries[key] = entry
+                if is_fresh(entry, stamp):
+                    local.set(key, entry)
+    return entries
+
+
+def recently_written(scopes):
+    """Tell if the scopes were written within READ_YOUR_WRITES_TTL."""
+    return (time() - last_modified(scopes).timestamp()
+            < settings.READ_YOUR_WRITES_TTL)
+
+
+def reading_primary(scopes):
+    """Return the context reading recently written scopes from the primary."""
+    return routers.primary(bool(
+        scopes and settings.DATABASE_REPLICAS and recently_written(scopes)))
+
+
+def single_flight(key, stamp, timeout, build, entry=None, scopes=()):
+    """Build the entry by one request at a time and return its content.
+
+    The request taking the lock builds the content and stores it for
+    timeout seconds, the entry itself is kept settings.CACHE_STALE_TTL
+    seconds longer. Other requests get the stale content of the entry or,
+    if there is none, wait for the new one while the lock is held. None
+    returned by build() is not cached. The entry of the recently written
+    scopes is built from the primary database.
+    """
+    lock = f'lock:{key}'
+    if cache.add(lock, 1, settings.CACHE_LOCK_TIMEOUT):
+        try:
+            start = perf_counter()
+            with reading_primary(scopes):
+                content = build()
+            if content is not None:
+                entry = {
+                    'stamp': stamp,
+                    'expires': time() + timeout,
+                    'delta': perf_counter() - start,
+                    'content': content,
+                }
+                cache.set(key, entry, timeout + settings.CACHE_STALE_TTL)
+                local.set(key, entry)
+        finally:
+            cache.delete(lock)
+        return content
+    if entry is not None:
+        return entry['content']
+    # The lock released with no fresh entry means that build() raised,
+    # returned None or was outdated, so the request builds it itself.
+    deadline = time() + settings.CACHE_LOCK_TIMEOUT
+    while time() < deadline:
+        sleep(0.05)
+        entries = cache.get_many([lock, key])
+        entry = entries.get(key)
+        if entry is not None and entry['stamp'] == stamp:
+            return entry['content']
+        if lock not in entries:
+            break
+    with reading_primary(scopes):
+        return build()
+
+
+def render_posts(request, posts, paged=True):
+    """Return the rendered cards of the posts.
+
+    The versions and the cards are read by two get_many, the cards built
+    for other versions or numbers of comments are rendered again with
+    punched holes. The holes are filled for the visitor unless the page
+    itself is cached with them.
+    """
+    posts = list(posts)
+    versions = get_versions([f'post:{post.pk}' for post in posts])
+    keys = [f'card:{post.pk}:{int(bool(paged))}' for post in posts]
+    stamps = [
+        f'{version}:{post.comment_count}'
+        for post, version in zip(posts, versions)
+    ]
+    entries = get_entries(keys, stamps)
+    punch_holes = getattr(request, 'punch_holes', False)
+    request.punch_holes = True
+    try:
+        cards = []
+        for post, stamp, key in zip(posts, stamps, keys):
+            entry = entries.get(key)
+            if is_fresh(entry, stamp):
+                cards.append(entry['content'])
+                continue
+            cards.append(single_flight(
+                key,
+                stamp,
+                settings.CACHE_TTL,
+                lambda post=post: render_to_string(
+                    POST_CARD, {'post': post, 'page': paged},
+                    request=request),
+                entry,
+            ))
+    finally:
+        request.punch_holes = punch_holes
+    content = ''.join(cards)
+    return content if punch_holes else fill_holes(content, request)
+
+
+def page_key(key_prefix, request):
+    path = md5(request.get_full_path().encode()).hexdigest()
+    return f'page:{key_prefix}:{path}'
+
+
+def shared_page(key, stamp, timeout, scopes, view, request, *args,
+                **kwargs):
+    """Return the content of the page with punched holes and the response.
+
+    The response is None when the content is read from the cache. The
+    content is None for the responses other than 200 and the streaming
+    ones, they are not cached.
+    """
+    entry = get_entries([key], [stamp]).get(key)
+    if is_fresh(entry, stamp):
+        return entry['content'], None
+    response = None
+
+    def build():
+        nonlocal response
+        request.punch_holes = True
+        try:
+            response = view(request, *args, **kwargs)
+        finally:
+            request.punch_holes = False
+        if response.status_code != 200 or response.streaming:
+            return None
+        return response.content.decode(response.charset)
+
+    content = single_flight(key, stamp, timeout, build, entry, scopes)
+    return content, response
+
+
+def cache_shared_page(timeout, key_prefix, scopes=('feed',)):
+    """Cache the page with punched holes once for all visitors.
+
+    Unlike cache_page with vary_on_cookie, the key depends only on the URL
+    and the stamp on the versions of the scopes. The scopes are the list of
+    names or the function taking the arguments of the view and returning
+    the list. The response is private for authenticated visitors only.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return view(request, *args, **kwargs)
+            names = (
+                scopes(request, *args, **kwargs) if callable(scopes)
+                else scopes
+            )
+            stamp = '.'.join(map(str, get_versions(names)))
+            content, response = shared_page(
+                page_key(key_prefix, request), stamp, timeout, names, view,
+                request, *args, **kwargs)
+            record(key_prefix, response is None)
+            if content is None:
+                return response
+            if response is None:
+                response = HttpResponse()
+            response.content = fill_holes(content, request)
+            patch_vary_headers(response, ('Cookie',))
+            if request.user.is_authenticated:
+                patch_cache_control(response, private=True)
+            return response
+        return wrapper
+    return decorator
+
+
+def cached_object(scope, key, build, timeout=settings.CACHE_TTL):
+    """Return the object built for the current version of the scope.
+
+    The object lives in the local and the shared cache; the exception
+    raised by build() (like Http404) is not cached.
+    """
+    stamp = str(get_versions([scope])[0])
+    entry = get_entries([key], [stamp]).get(key)
+    if is_fresh(entry, stamp):
+        return entry['content']
+    return single_flight(key, stamp, timeout, build, entry, [scope])
@@ -0,0 +1,225 @@
+"""Cache backend shared by all worker processes through a SQLite file.
+
+Unlike LocMemCache, every worker of the server reads and writes the same
+entries, so a page rendered by one worker is a hit for all of them. No
+external service is needed: the file is opened in WAL mode, so readers do
+not block each other and the writer.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'posts.cache_backend.SQLiteCache',
+        'LOCATION': '/var/cache/yatube/cache.sqlite3',
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    }
+}
+
+The entries over MAX_ENTRIES are evicted by the least recent access, which
+is tracked with the resolution of TOUCH_RESOLUTION seconds to keep plain
+reads free of writes. The entries are counted once in CULL_EVERY writes of
+the process (100 by default), so the cache may exceed MAX_ENTRIES by that
+many writes of every worker. incr() is atomic between the processes.
+"""
+import itertools
+import os
+import pickle
+import sqlite3
+import threading
+import time
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+TOUCH_RESOLUTION = 1.0
+
+SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS cache ('
+    'key TEXT PRIMARY KEY, value BLOB NOT NULL, '
+    'expires REAL, accessed REAL NOT NULL) WITHOUT ROWID',
+    'CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed)',
+)
+VALID = '(expires IS NULL OR expires > ?)'
+
+
+class SQLiteCache(BaseCache):
+    """Cache stored in the SQLite file shared by the processes."""
+
+    pickle_protocol = pickle.HIGHEST_PROTOCOL
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        self.location = str(location)
+        self._local = threading.local()
+        options = params.get('OPTIONS', {})
+        self._cull_every = int(options.get('CULL_EVERY', 100))
+        self._writes = itertools.count(1)
+
+    @property
+    def connection(self):
+        # The connection is opened per thread and again after the fork.
+        local = self._local
+        if getattr(local, 'pid', None) != os.getpid():
+            local.connection = sqlite3.connect(
+                self.location,
+                timeout=30,
+                isolation_level=None,
+                check_same_thread=False,
+            )
+            local.connection.execute('PRAGMA journal_mode=WAL')
+            local.connection.execute('PRAGMA synchronous=NORMAL')
+            for statement in SCHEMA:
+                local.connection.execute(statement)
+            local.pid = os.getpid()
+        return local.connection
+
+    def _dumps(self, value):
+        return pickle.dumps(value, self.pickle_protocol)
+
+    def _keys(self, keys, version):
+        return {
+            self.make_and_validate_key(key, version=version): key
+            for key in keys
+        }
+
+    def _select(self, keys):
+        now = time.time()
+        placeholders = ', '.join('?' * len(keys))
+        rows = self.connection.execute(
+            f'SELECT key, value, accessed FROM cache '
+            f'WHERE key IN ({placeholders}) AND {VALID}',
+            (*keys, now),
+        ).fetchall()
+        stale = [key for key, _, accessed in rows
+                 if accessed < now - TOUCH_RESOLUTION]
+        if stale:
+            placeholders = ', '.join('?' * len(stale))
+            self.connection.execute(
+                f'UPDATE cache SET accessed = ? WHERE key IN ({placeholders})',
+                (now, *stale),
+            )
+        return {key: pickle.loads(value) for key, value, _ in rows}
+
+    def get(self, key, default=None, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        return self._select([key]).get(key, default)
+
+    def get_many(self, keys, version=None):
+        keys = self._keys(keys, version)
+        if not keys:
+            return {}
+        return {
+            keys[key]: value
+            for key, value in self._select(list(keys)).items()
+        }
+
+    def _write(self, items, expires, only_missing=False):
+        now = time.time()
+        if expires is not None and expires <= now:
+            self._delete(list(items))
+            return 0
+        statement = (
+            'INSERT INTO cache (key, value, expires, accessed) '
+            'VALUES (?, ?, ?, ?) ON CONFLICT (key) DO UPDATE SET '
+            'value = excluded.value, expires = excluded.expires, '
+            'accessed = excluded.accessed'
+        )
+        if only_missing:
+            statement += ' WHERE NOT ' + VALID.replace(
+                'expires', 'cache.expires')
+        connection = self.connection
+        with connection:
+            connection.execute('BEGIN IMMEDIATE')
+            changed = 0
+            for key, value in items.items():
+                parameters = (key, self._dumps(value), expires, now)
+                if only_missing:
+                    parameters += (now,)
+                changed += connection.execute(statement, parameters).rowcount
+            self._cull(now)
+        return changed
+
+    def _cull(self, now):
+        if next(self._writes) % self._cull_every:
+            return
+        connection = self.connection
+        count, = connection.execute('SELECT COUNT(*) FROM cache').fetchone()
+        if count <= self._max_entries:
+            return
+        connection.execute('DELETE FROM cache WHERE expires <= ?', (now,))
+        count, = connection.execute('SELECT COUNT(*) FROM cache').fetchone()
+        if count > self._max_entries:
+            connection.execute(
+                'DELETE FROM cache WHERE key IN ('
+                'SELECT key FROM cache ORDER BY accessed LIMIT ?)',
+                (count // self._cull_frequency or 1,),
+            )
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        expires = self.get_backend_timeout(timeout)
+        return bool(self._write({key: value}, expires, only_missing=True))
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        self._write({key: value}, self.get_backend_timeout(timeout))
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        items = {
+            self.make_and_validate_key(key, version=version): value
+            for key, value in data.items()
+        }
+        if items:
+            self._write(items, self.get_backend_timeout(timeout))
+        return []
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        now = time.time()
+        return bool(self.connection.execute(
+            f'UPDATE cache SET expires = ?, accessed = ? '
+            f'WHERE key = ? AND {VALID}',
+            (self.get_backend_timeout(timeout), now, key, now),
+        ).rowcount)
+
+    def incr(self, key, delta=1, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        connection = self.connection
+        with connection:
+            # The write lock is taken before the read, so no process can
+            # change the value between them.
+            connection.execute('BEGIN IMMEDIATE')
+            row = connection.execute(
+                f'SELECT value FROM cache WHERE key = ? AND {VALID}',
+                (key, time.time()),
+            ).fetchone()
+            if row is None:
+                raise ValueError(f"Key '{key}' not found")
+            value = pickle.loads(row[0]) + delta
+            connection.execute(
+                'UPDATE cache SET value = ? WHERE key = ?',
+                (self._dumps(value), key),
+            )
+        return value
+
+    def has_key(self, key, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        return self.connection.execute(
+            f'SELECT 1 FROM cache WHERE key = ? AND {VALID}',
+            (key, time.time()),
+        ).fetchone() is not None
+
+    def _delete(self, keys):
+        placeholders = ', '.join('?' * len(keys))
+        return self.connection.execute(
+            f'DELETE FROM cache WHERE key IN ({placeholders})', keys,
+        ).rowcount
+
+    def delete(self, key, version=None):
+        return bool(self._delete([self.make_and_validate_key(
+            key, version=version)]))
+
+    def delete_many(self, keys, version=None):
+        keys = list(self._keys(keys, version))
+        if keys:
+            self._delete(keys)
+
+    def clear(self):
+        self.connection.execute('DELETE FROM cache')
@@ -0,0 +1,170 @@
+"""Incrementally maintained post totals of the paginated feeds.
+
+Every feed is identified by the counter name: 'posts' for the main page,
+'group:<id>', 'author:<id>' and 'feed:<id>' for the group, the profile and
+the follow page (the timeline, see posts.feeds) of the user. Writes only
+shift existing counters, a missing counter is computed once on the first
+read. The same way the AuthorStats record keeps the numbers shown on the
+author card. Anything that bypasses the signals (bulk operations, SET_NULL
+on a group deletion) may leave a drift, the rebuild_counters command fixes
+it.
+"""
+from django.db import transaction
+from django.db.models import Count, F
+
+from .models import AuthorStats, Counter, FeedItem, Follow, Post
+from .routers import side_writes
+
+POSTS = 'posts'
+STATS_FIELDS = ('posts', 'followers', 'following')
+
+SCOPE_LOOKUPS = {
+    'group': 'group_id',
+    'author': 'author_id',
+    'feed': 'feed_items__user_id',
+}
+
+
+def counter_name(scope, pk=None):
+    """Return the name of the counter for the scope."""
+    return scope if pk is None else f'{scope}:{pk}'
+
+
+def counted_queryset(name):
+    """Return queryset which is counted by the counter."""
+    scope, _, pk = name.partition(':')
+    if scope == POSTS:
+        return Post.objects.all()
+    return Post.objects.filter(**{SCOPE_LOOKUPS[scope]: pk})
+
+
+def get_count(name):
+    """Return value of the counter, computing it on the first call."""
+    value = Counter.objects.filter(name=name).values_list(
+        'value', flat=True).first()
+    if value is None:
+        with side_writes():
+            counter, _ = Counter.objects.get_or_create(
+                name=name,
+                defaults={'value': counted_queryset(name).count()},
+            )
+        value = counter.value
+    return value
+
+
+def get_counts(names):
+    """Return dictionary of values of the counters by one query."""
+    values = dict(Counter.objects.filter(name__in=names).values_list(
+        'name', 'value'))
+    for name in set(names) - set(values):
+        values[name] = get_count(name)
+    return values
+
+
+def change(names, delta):
+    """Shift the existing counters by delta."""
+    if names and delta:
+        Counter.objects.filter(name__in=names).update(value=F('value') + delta)
+
+
+def post_counter_names(post):
+    """Return names of the counters which include the post.
+
+    Feed counters are shifted by posts.feeds with the timelines.
+    """
+    names = [POSTS, counter_name('author', post.author_id)]
+    if post.group_id:
+        names.append(counter_name('group', post.group_id))
+    return names
+
+
+def aggregated_counters():
+    """Return the counters computed from aggregates."""
+    yield Counter(name=POSTS, value=Post.objects.count())
+    for scope, lookup in (('group', 'group'), ('author', 'author')):
+        totals = Post.objects.filter(
+            **{f'{lookup}__isnull': False}
+        ).order_by().values(lookup).annotate(total=Count('pk'))
+        for row in totals:
+            yield Counter(
+                name=counter_name(scope, row[lookup]),
+                value=row['total'],
+            )
+    yield from feed_counters()
+
+
+def feed_counters():
+    """Return the counters of the timelines computed from aggregates."""
+    totals = FeedItem.objects.order_by().values('user').annotate(
+        total=Count('pk'))
+    for row in totals:
+        yield Counter(
+            name=counter_name('feed', row['user']),
+            value=row['total'],
+        )
+
+
+@transaction.atomic
+def rebuild(batch_size=1000):
+    """Replace all counters with the values computed from aggregates."""
+    Counter.objects.all().delete()
+    return len(Counter.objects.bulk_create(
+        aggregated_counters(),
+        batch_size=batch_size,
+    ))
+
+
+def computed_stats(user_id):
+    """Return unsaved AuthorStats of the user computed by COUNT queries."""
+    return AuthorStats(
+        user_id=user_id,
+        posts=Post.objects.filter(author_id=user_id).count(),
+        followers=Follow.objects.filter(author_id=user_id).count(),
+        following=Follow.objects.filter(user_id=user_id).count(),
+    )
+
+
+def author_stats(user):
+    """Return stats of the author, computing them on the first call.
+
+    Load the user with select_related('stats') to get them without queries.
+    """
+    try:
+        return user.stats
+    except AuthorStats.DoesNotExist:
+        stats = computed_stats(user.pk)
+        with side_writes():
+            stats, _ = AuthorStats.objects.get_or_create(
+                user=user,
+                defaults={
+                    field: getattr(stats, field) for field in STATS_FIELDS
+                },
+            )
+        return stats
+
+
+def shift_stats(user_id, **deltas):
+    """Shift the existing stats of the user by deltas."""
+    AuthorStats.objects.filter(user_id=user_id).update(**{
+        field: F(field) + delta for field, delta in deltas.items()
+    })
+
+
+def stats_drift():
+    """Yield (stats, expected values) for every stats record with drift."""
+    totals = {
+        'posts': Post.objects.values_list('author'),
+        'followers': Follow.objects.values_list('author'),
+        'following': Follow.objects.values_list('user'),
+    }
+    expected = {
+        field: dict(queryset.order_by().annotate(total=Count('pk')))
+        for field, queryset in totals.items()
+    }
+    for stats in AuthorStats.objects.order_by('pk').iterator():
+        values = {
+            field: expected[field].get(stats.pk, 0) for field in STATS_FIELDS
+        }
+        if any(getattr(stats, field) != value
+               for field, value in values.items()):
+            yield stats, values
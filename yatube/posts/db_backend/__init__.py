@@ -0,0 +1,37 @@
+"""SQLite database backend taking the write lock at the start of a write.
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'posts.db_backend',
+        ...
+    }
+}
+
+A deferred transaction reads first and takes the write lock on its first
+write. If another connection has written since that read, SQLite fails
+the write at once with 'database is locked', whatever busy_timeout is set.
+The transactions of the unsafe requests (posts.middleware.write_lock) are
+started with BEGIN IMMEDIATE instead, they wait for the lock up to
+busy_timeout and then see the latest data. The same lock is taken outside
+the requests by write_transaction.
+"""
+from contextlib import contextmanager
+
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+
+@contextmanager
+def write_transaction(using=DEFAULT_DB_ALIAS):
+    """Run the block in a transaction holding the write lock from its start.
+
+    Inside an open transaction the block runs in a savepoint of it. The
+    other database backends ignore the flag.
+    """
+    connection = connections[using]
+    begin_immediate = getattr(connection, 'begin_immediate', False)
+    connection.begin_immediate = True
+    try:
+        with transaction.atomic(using=using):
+            yield
+    finally:
+        connection.begin_immediate = begin_immediate
@@ -0,0 +1,261 @@
+"""Feeds of posts shown by the views.
+
+The querysets of every feed are built here, so views and the query plan
+audit (the audit_query_plans command) run exactly the same queries.
+
+The engine building the follow page is chosen by settings.FOLLOW_FEED_ENGINE:
+'join' filters posts through the Follow join, 'timeline' reads the
+materialized timeline and 'merge' merges cached lists of recent posts of the
+followed authors (see MergedFeed).
+
+Every user has own timeline of FeedItem rows (user, post, pub_date). A new
+post is fanned out to the followers of its author by batches, a new follow
+backfills the latest posts of the author and an unfollow prunes them. So the
+follow page is a range scan of the (user, pub_date, post) index instead of the
+join of Follow and Post. The feed counters of posts.counters count the rows
+of the timeline and are shifted here.
+"""
+from heapq import merge
+from itertools import islice, takewhile
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils.functional import cached_property
+
+from . import counters
+from .models import Counter, FeedItem, Follow, Post
+
+
+def index_feed():
+    """Return posts of the main page."""
+    return Post.objects.select_related('author', 'group')
+
+
+def group_feed(group):
+    """Return posts of the group."""
+    return group.posts.select_related('author')
+
+
+def author_feed(author):
+    """Return posts of the profile of the author."""
+    return author.posts.select_related('group')
+
+
+def post_comments(post):
+    """Return comments shown on the page of the post."""
+    return post.comments.select_related('author')
+
+
+class MergedFeed:
+    """Follow feed merged from cached lists of recent posts of the authors.
+
+    Every author has a cached list of (pub_date, pk) of the latest
+    settings.FEED_AUTHOR_CACHE_SIZE posts, it is dropped on any write of
+    the author's posts. A slice of the feed is taken from the k-way heap
+    merge of the lists of the followed authors while the merge is exact,
+    that is above the oldest entry of the truncated lists. Deeper slices
+    are taken from the fallback join queryset. The object quacks like a
+    sequence, so Paginator handles it as a queryset.
+    """
+
+    def __init__(self, user):
+        self.user = user
+        self.fallback = joined_feed(user)
+
+    @cached_property
+    def author_ids(self):
+        return list(Follow.objects.filter(user=self.user).values_list(
+            'author_id', flat=True))
+
+    def count(self):
+        return sum(counters.get_counts([
+            counters.counter_name('author', author_id)
+            for author_id in self.author_ids
+        ]).values())
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice):
+            return self[key:key + 1][0]
+        lists = recent_posts(self.author_ids)
+        limit = settings.FEED_AUTHOR_CACHE_SIZE
+        horizon = max(
+            (entries[-1] for entries in lists if len(entries) >= limit),
+            default=None,
+        )
+        merged = merge(*lists, reverse=True)
+        if horizon is not None:
+            merged = takewhile(lambda entry: entry >= horizon, merged)
+        entries = list(islice(merged, key.stop))
+        if horizon is not None and len(entries) < key.stop:
+            return list(self.fallback[key])
+        ids = [pk for _, pk in entries[key]]
+        posts = Post.objects.select_related('author', 'group').in_bulk(ids)
+        return [posts[pk] for pk in ids if pk in posts]
+
+
+def author_posts_key(author_id):
+    return f'author_posts:{author_id}'
+
+
+def recent_posts(author_ids):
+    """Return cached lists of (pub_date, pk) of the authors, newest first."""
+    keys = {author_posts_key(author_id): author_id for author_id in author_ids}
+    lists = cache.get_many(keys)
+    missing = {}
+    for key, author_id in keys.items():
+        if key not in lists:
+            missing[key] = list(Post.objects.filter(
+                author_id=author_id).order_by('-pub_date', '-pk').values_list(
+                'pub_date', 'pk')[:settings.FEED_AUTHOR_CACHE_SIZE])
+    cache.set_many(missing, settings.FEED_AUTHOR_CACHE_TTL)
+    return [*lists.values(), *missing.values()]
+
+
+def forget_author(author_id):
+    """Drop the cached list of the recent posts of the author."""
+    cache.delete(author_posts_key(author_id))
+
+
+def joined_feed(user):
+    """Return posts of the authors followed by the user through the join."""
+    return Post.objects.filter(
+        author__following__user=user
+    ).select_related('author', 'group')
+
+
+def timeline_feed(user):
+    """Return posts of the timeline of the user, newest first.
+
+    The posts are ordered by the columns of the timeline, so the index of
+    the timeline serves both the ordering and the cursor of the paginator.
+    """
+    return Post.objects.filter(feed_items__user=user).annotate(
+        feed_pub_date=F('feed_items__pub_date'),
+        feed_post_id=F('feed_items__post_id'),
+    ).select_related('author', 'group').order_by(
+        '-feed_pub_date', '-feed_post_id')
+
+
+ENGINES = {
+    'join': joined_feed,
+    'timeline': timeline_feed,
+    'merge': MergedFeed,
+}
+
+
+def follow_feed(user):
+    """Return follow feed of the user built by the configured engine."""
+    return ENGINES[settings.FOLLOW_FEED_ENGINE](user)
+
+
+def follow_counter(user):
+    """Return name of the counter of the follow feed or None.
+
+    Only the timeline is counted by the feed counter, the merged feed sums
+    the author counters itself and the join is counted by COUNT(*).
+    """
+    if settings.FOLLOW_FEED_ENGINE == 'timeline':
+        return counters.counter_name('feed', user.pk)
+    return None
+
+
+def fan_out(post, batch_size=settings.FEED_FANOUT_BATCH):
+    """Put the new post into timelines of all followers of its author."""
+    followers = Follow.objects.filter(author_id=post.author_id).order_by(
+        'pk').values_list('user_id', flat=True)
+    batch = []
+    for user_id in followers.iterator(chunk_size=batch_size):
+        batch.append(user_id)
+        if len(batch) == batch_size:
+            _deliver(post, batch)
+            batch = []
+    _deliver(post, batch)
+
+
+def _deliver(post, user_ids):
+    if not user_ids:
+        return
+    with transaction.atomic():
+        # bulk_create returns all objects with ignore_conflicts, so the
+        # readers are counted by the rows present before and after it.
+        present = FeedItem.objects.filter(post=post, user_id__in=user_ids)
+        before = set(present.values_list('user_id', flat=True))
+        FeedItem.objects.bulk_create(
+            (FeedItem(user_id=user_id, post=post, pub_date=post.pub_date)
+             for user_id in user_ids if user_id not in before),
+            ignore_conflicts=True,
+        )
+        added = set(present.values_list('user_id', flat=True)) - before
+        counters.change(
+            [counters.counter_name('feed', user_id) for user_id in added],
+            1,
+        )
+
+
+def backfill(user_id, author_id, limit=settings.FEED_BACKFILL_COUNT):
+    """Put the latest posts of the author into the timeline of the user."""
+    posts = Post.objects.filter(author_id=author_id).order_by(
+        '-pub_date').values_list('pk', 'pub_date')[:limit]
+    with transaction.atomic():
+        posts = list(posts)
+        present = FeedItem.objects.filter(
+            user_id=user_id, post_id__in=[pk for pk, _ in posts])
+        before = present.count()
+        FeedItem.objects.bulk_create(
+            (FeedItem(user_id=user_id, post_id=pk, pub_date=pub_date)
+             for pk, pub_date in posts),
+            ignore_conflicts=True,
+        )
+        counters.change(
+            [counters.counter_name('feed', user_id)],
+            present.count() - before,
+        )
+
+
+def prune(user_id, author_id):
+    """Remove posts of the author from the timeline of the user."""
+    with transaction.atomic():
+        deleted, _ = FeedItem.objects.filter(
+            user_id=user_id, post__author_id=author_id).delete()
+        counters.change([counters.counter_name('feed', user_id)], -deleted)
+
+
+def withdraw(post):
+    """Uncount the post from the timelines before its deletion."""
+    readers = post.feed_items.values_list('user_id', flat=True)
+    counters.change(
+        [counters.counter_name('feed', user_id) for user_id in readers],
+        -1,
+    )
+
+
+@transaction.atomic
+def rebuild(limit=settings.FEED_BACKFILL_COUNT, batch_size=1000):
+    """Fill all timelines again from the subscriptions.
+
+    The latest posts of every author are numbered by a window function, so
+    all timelines are filled by one INSERT ... SELECT.
+    """
+    FeedItem.objects.all().delete()
+    Counter.objects.filter(name__startswith='feed:').delete()
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'INSERT INTO posts_feeditem (user_id, post_id, pub_date) '
+            'SELECT follow.user_id, latest.id, latest.pub_date '
+            'FROM posts_follow AS follow JOIN ('
+            'SELECT id, author_id, pub_date, ROW_NUMBER() OVER ('
+            'PARTITION BY author_id ORDER BY pub_date DESC, id DESC'
+            ') AS number FROM posts_post'
+            ') AS latest ON latest.author_id = follow.author_id '
+            'WHERE latest.number <= %s',
+            (limit,),
+        )
+        total = cursor.rowcount
+    Counter.objects.bulk_create(
+        counters.feed_counters(), batch_size=batch_size)
+    return total
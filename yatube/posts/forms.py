@@ -1,6 +1,9 @@
 from django import forms
+from django.core.files.uploadedfile import UploadedFile
 
+from .images import ingest
 from .models import Comment, Post
+from .thumbnails import schedule
 
 
 class PostForm(forms.ModelForm):
@@ -9,6 +12,28 @@ class PostForm(forms.ModelForm):
         model = Post
         fields = ('group', 'text', 'image')
 
+    def clean_image(self):
+        """Store the reduced copy of the new upload instead of it."""
+        image = self.cleaned_data['image']
+        if isinstance(image, UploadedFile):
+            return ingest(image)
+        return image
+
+    def save(self, commit=True):
+        """Save the post and schedule the thumbnails of a new image."""
+        new_image = 'image' in self.changed_data
+        if new_image:
+            image = self.cleaned_data['image']
+            self.instance.thumbnails_ready = False
+            self.instance.image_variants = {}
+            self.instance.image_width = image.width if image else None
+            self.instance.image_height = image.height if image else None
+            self.instance.image_bytes = image.size if image else None
+        post = super().save(commit)
+        if commit and new_image and post.image:
+            schedule(post)
+        return post
+
 
 class CommentForm(forms.ModelForm):
 
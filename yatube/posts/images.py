@@ -0,0 +1,77 @@
+"""Ingestion of the uploaded post images.
+
+The upload is never stored as is: its size is checked by the header before
+any pixel is decoded, JPEG is decoded right at the reduced scale (draft),
+the image is reduced to settings.IMAGE_MAX_SIZE, turned by the EXIF
+orientation and encoded again without the EXIF and the other metadata but
+the colour profile and transparency. So the memory taken by an upload is
+bounded by the settings, not by the upload.
+"""
+from io import BytesIO
+from os.path import splitext
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files.images import ImageFile
+from PIL import Image, ImageOps
+
+# The formats stored as is; the others are stored as JPEG or PNG.
+FORMATS = {'JPEG': 'jpg', 'PNG': 'png', 'GIF': 'gif', 'WEBP': 'webp'}
+
+
+def check_size(image, limit):
+    width, height = image.size
+    if width * height > limit:
+        raise ValidationError(
+            'Изображение слишком большое: %(width)s×%(height)s.',
+            code='image_too_large',
+            params={'width': width, 'height': height},
+        )
+
+
+def ingest(upload):
+    """Return the reduced image of the upload without the metadata.
+
+    The result is the ImageFile to store instead of the upload, its width,
+    height and size are those stored. The image of another format than
+    FORMATS is stored as JPEG or PNG.
+    """
+    upload.seek(0)
+    try:
+        image = Image.open(upload)
+    except (Image.DecompressionBombError, OSError):
+        raise ValidationError(
+            'Загрузите правильное изображение.', code='invalid_image')
+    check_size(image, settings.IMAGE_MAX_PIXELS)
+    size = (settings.IMAGE_MAX_SIZE, settings.IMAGE_MAX_SIZE)
+    # Only JPEG can be decoded at the reduced scale, the other formats are
+    # decoded in full.
+    image.draft('RGB', size)
+    check_size(image, settings.IMAGE_MAX_DECODED_PIXELS)
+    image_format = image.format
+    kept = {
+        key: image.info[key]
+        for key in ('icc_profile', 'transparency') if key in image.info
+    }
+    try:
+        image.thumbnail(size, Image.Resampling.LANCZOS)
+        image = ImageOps.exif_transpose(image)
+    except OSError:
+        raise ValidationError(
+            'Загрузите правильное изображение.', code='invalid_image')
+    name = upload.name
+    if image_format not in FORMATS:
+        image_format = 'PNG' if 'A' in image.getbands() else 'JPEG'
+        name = f'{splitext(name)[0]}.{FORMATS[image_format]}'
+    if image_format == 'JPEG' and image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    content = BytesIO()
+    # The EXIF and the rest of the info are not passed to save().
+    image.save(
+        content,
+        image_format,
+        quality=settings.IMAGE_QUALITY,
+        optimize=True,
+        **kept,
+    )
+    return ImageFile(content, name=name)
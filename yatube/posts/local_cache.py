@@ -0,0 +1,54 @@
+"""In-process LRU cache in front of the shared cache.
+
+It keeps the hottest entries in the memory of the worker, so reading them
+costs no round trip to the cache backend. The entries are bounded both by
+number and by age; the values are shared by the threads of the worker and
+must be treated as read-only.
+"""
+from collections import OrderedDict
+from threading import Lock
+from time import monotonic
+
+MISSING = object()
+
+
+class LocalCache:
+    """Bounded LRU mapping with the time to live of every entry."""
+
+    def __init__(self, size, ttl):
+        self.size = size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            value, expires = self._entries.get(key, (MISSING, 0))
+            if value is MISSING:
+                return default
+            if expires <= monotonic():
+                del self._entries[key]
+                return default
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        if self.size <= 0:
+            return
+        expires = monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._entries[key] = (value, expires)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
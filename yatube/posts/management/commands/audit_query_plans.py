@@ -0,0 +1,96 @@
+import re
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+
+from posts import feeds, search, thumbnails
+from posts.models import Comment, Counter, Group, Post, User
+from posts.paginator import CursorPaginator
+
+# A virtual table scanned by the MATCH constraint is a lookup of the index.
+FULL_SCAN = re.compile(
+    r'\bSCAN (?!.*\b(USING (COVERING )?INDEX\b|VIRTUAL TABLE INDEX \d+:M))')
+TEMP_SORT = re.compile(r'USE TEMP B-TREE')
+
+
+def plan_problems(queryset):
+    """Return the lines of the query plan with a full scan or a temp sort."""
+    plan = queryset.explain()
+    return [
+        line for line in plan.splitlines()
+        if FULL_SCAN.search(line) or TEMP_SORT.search(line)
+    ]
+
+
+def hot_queries():
+    """Return (name, queryset) of the queries run by the posts views.
+
+    Parameters of the queries do not influence the plan, so stub objects
+    stand for the group, the author, the reader and the post. The 'join'
+    follow feed engine needs a temporary sort by design and is reported.
+    """
+    group = Group(pk=1, slug='slug')
+    author = User(pk=1, username='author')
+    reader = User(pk=2, username='reader')
+    post = Post(pk=1, author=author, pub_date=timezone.now())
+    per_page = settings.MAX_PAGE_COUNT
+    paged_feeds = (
+        ('index', feeds.index_feed()),
+        ('group_posts', feeds.group_feed(group)),
+        ('profile', feeds.author_feed(author)),
+    )
+    if settings.FOLLOW_FEED_ENGINE == 'merge':
+        yield 'follow_index: author posts', Post.objects.filter(
+            author_id=author.pk).order_by('-pub_date', '-pk').values_list(
+            'pub_date', 'pk')[:settings.FEED_AUTHOR_CACHE_SIZE]
+        # in_bulk() drops the ordering of the queryset.
+        yield 'follow_index: posts', feeds.index_feed().filter(
+            pk__in=(1, 2)).order_by()
+    else:
+        paged_feeds += (('follow_index', feeds.follow_feed(reader)),)
+    for name, queryset in paged_feeds:
+        paginator = CursorPaginator(queryset, per_page)
+        yield f'{name}: page', queryset[per_page:2 * per_page]
+        yield f'{name}: cursor', paginator.queryset.filter(
+            paginator._seek('lt', (post.pub_date, post.pk))
+        ).order_by(*(f'-{key}' for key in paginator.keys))[:per_page + 1]
+    yield 'counter', Counter.objects.filter(name='posts')
+    yield 'group by slug', Group.objects.filter(slug=group.slug)
+    yield 'user by username', User.objects.filter(username=author.username)
+    yield 'following', reader.follower.filter(author=author)
+    # get() drops the ordering of the queryset.
+    yield 'post', Post.objects.filter(
+        pk=post.pk, author__username=author.username).order_by()
+    yield 'post comments', feeds.post_comments(post)
+    yield 'thumbnails pending', thumbnails.pending()[:settings.THUMBNAIL_BATCH]
+    # exists() drops the ordering of the queryset.
+    yield 'image references', Post.objects.filter(
+        image='posts/00/image.jpg').order_by()[:1]
+    yield 'admin search', search.filter_posts(
+        Post.objects.order_by('-pk'), 'text')[:100]
+    yield 'admin comments of author', Comment.objects.filter(
+        author=author).order_by('-pk')[:100]
+
+
+class Command(BaseCommand):
+    help = ('Check the query plans of the posts views: fail on a full scan '
+            'or a temporary sort.')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError('Only SQLite query plans are supported.')
+        failed = []
+        for name, queryset in hot_queries():
+            problems = plan_problems(queryset)
+            if problems:
+                failed.append(name)
+                self.stdout.write(self.style.ERROR(f'{name}: FAIL'))
+                self.stdout.write(str(queryset.query))
+                for line in problems:
+                    self.stdout.write(f'    {line}')
+            else:
+                self.stdout.write(f'{name}: OK')
+        if failed:
+            raise CommandError(f'Bad query plans: {", ".join(failed)}.')
@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import (setup_test_environment,
+                               teardown_test_environment)
+
+from posts import benchmarks
+from posts.benchmarks import SCENARIOS, temporary_database
+
+
+class Command(BaseCommand):
+    help = 'Run benchmarks of the hot paths on a temporary database.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'scenarios',
+            nargs='*',
+            help=(f'Scenarios to run, all of them by default. '
+                  f'Available: {", ".join(sorted(SCENARIOS))}.'),
+        )
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=20,
+            help='Number of measurements of every case.',
+        )
+        parser.add_argument(
+            '--scale',
+            type=float,
+            default=1,
+            help='Multiplier of the numbers of the rows of the scenarios.',
+        )
+
+    def handle(self, *args, **options):
+        names = options['scenarios'] or sorted(SCENARIOS)
+        unknown = set(names) - set(SCENARIOS)
+        if unknown:
+            raise CommandError(f'Unknown scenarios: {", ".join(unknown)}.')
+        setup_test_environment()
+        benchmarks.SCALE = options['scale']
+        try:
+            for name in names:
+                self.stdout.write(self.style.MIGRATE_HEADING(
+                    f'{name}: {SCENARIOS[name].__doc__}'))
+                # The rows of one scenario must not skew the next one.
+                with temporary_database():
+                    SCENARIOS[name](self.stdout, options['repeat'])
+        finally:
+            benchmarks.SCALE = 1
+            teardown_test_environment()
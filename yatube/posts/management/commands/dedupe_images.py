@@ -0,0 +1,102 @@
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from sorl.thumbnail import delete
+
+from posts import cache
+from posts.db_backend import write_transaction
+from posts.models import Post
+from posts.storage import content_name, is_addressed
+from posts.thumbnails import collect, make_variants
+
+
+class Command(BaseCommand):
+    help = ('Rename the stored post images by their content, so the same '
+            'bytes are stored and thumbnailed once, and delete the files '
+            'of the post images no post refers to.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Only report the images to rename and to delete.',
+        )
+
+    def rename(self, name, target):
+        # Under the write lock, like the uploads, so a concurrent release
+        # does not delete the target before the posts refer to it.
+        with write_transaction():
+            if not default_storage.exists(target):
+                with default_storage.open(name) as content:
+                    default_storage.save(target, content)
+            posts = Post.objects.filter(image=name)
+            ids = list(posts.values_list('pk', flat=True))
+            posts.update(image=target)
+        # The old thumbnails are shown until the new ones are made.
+        variants = make_variants(target)
+        posts = Post.objects.filter(pk__in=ids, image=target)
+        scopes = [
+            cache.post_scopes(*names) for names in posts.values_list(
+                'pk', 'author__username', 'group__slug')
+        ]
+        posts.update(image_variants=variants, thumbnails_ready=True)
+        for post_scopes in scopes:
+            cache.invalidate(post_scopes)
+        # No post refers to the old file now.
+        delete(name)
+
+    def stored(self, directory):
+        """Yield the names of all files under the directory of the storage."""
+        directories, files = default_storage.listdir(directory)
+        for name in files:
+            yield f'{directory}/{name}'
+        for name in directories:
+            yield from self.stored(f'{directory}/{name}')
+
+    def collect_orphans(self, dry_run):
+        """Delete the files of the post images no post refers to.
+
+        Return the number of such files.
+        """
+        directory = Post._meta.get_field('image').upload_to.rstrip('/')
+        if not default_storage.exists(directory):
+            return 0
+        referred = set(Post.objects.exclude(image='').exclude(
+            image=None).values_list('image', flat=True))
+        orphans = 0
+        for name in self.stored(directory):
+            if name in referred:
+                continue
+            # The post may have been saved since the names were read.
+            orphans += dry_run or collect(name)
+        return orphans
+
+    def handle(self, *args, **options):
+        names = Post.objects.exclude(image='').exclude(image=None).order_by(
+            'image').values_list('image', flat=True).distinct()
+        seen = set()
+        renamed = duplicates = 0
+        for name in names:
+            if is_addressed(name):
+                continue
+            try:
+                with default_storage.open(name) as content:
+                    target = content_name(name, content)
+                duplicate = target in seen or default_storage.exists(target)
+                if not options['dry_run']:
+                    self.rename(name, target)
+            except (OSError, SuspiciousFileOperation) as error:
+                self.stderr.write(f'{name}: {error}')
+                continue
+            seen.add(target)
+            renamed += 1
+            duplicates += duplicate
+        self.stdout.write(self.style.SUCCESS(
+            f'Renamed images: {renamed}, duplicates: {duplicates}'
+            + (' (not renamed)' if options['dry_run'] else '')
+        ))
+        orphans = self.collect_orphans(options['dry_run'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Orphaned images: {orphans}'
+            + (' (not deleted)' if options['dry_run'] else '')
+        ))
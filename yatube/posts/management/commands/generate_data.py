@@ -0,0 +1,295 @@
+import random
+from array import array
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from itertools import accumulate
+from time import perf_counter, time
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from posts import cache, counters, feeds
+from posts.models import Comment, Follow, Group, Post, User
+
+WORDS = (
+    'привет', 'город', 'утро', 'кофе', 'книга', 'поезд', 'море', 'дождь',
+    'работа', 'друзья', 'проект', 'кот', 'собака', 'зима', 'лето', 'фото',
+    'музыка', 'фильм', 'дорога', 'горы', 'лес', 'река', 'ужин', 'новость',
+    'вечер', 'выходные', 'идея', 'код', 'сад', 'небо', 'отпуск', 'праздник',
+    'очень', 'сегодня', 'снова', 'наконец', 'красивый', 'новый', 'старый',
+    'большой', 'тихий', 'долгий', 'первый', 'последний', 'лучший', 'смешной',
+)
+DAY = 24 * 60 * 60
+
+
+@contextmanager
+def explicit_dates(*fields):
+    """Let bulk_create store the dates set on the objects.
+
+    auto_now_add fields are set to the current time on insert otherwise.
+    """
+    for field in fields:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field in fields:
+            field.auto_now_add = True
+
+
+def moment(timestamp):
+    return datetime.fromtimestamp(timestamp, timezone.utc)
+
+
+def text(words):
+    return ' '.join(random.choices(WORDS, k=words)).capitalize() + '.'
+
+
+class Command(BaseCommand):
+    help = ('Fill the database with synthetic users, groups, posts, '
+            'comments and follows by bulk inserts. The posts and the '
+            'followers of the authors have the power-law distribution, a '
+            'few viral posts collect a share of all comments.')
+
+    def add_arguments(self, parser):
+        for name, default in (
+                ('users', 10000), ('groups', 50), ('posts', 100000),
+                ('comments', 300000), ('follows', 200000)):
+            parser.add_argument(
+                f'--{name}',
+                type=int,
+                default=default,
+                help=f'Number of the {name} to create.',
+            )
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=365,
+            help='The posts are spread over this many last days.',
+        )
+        parser.add_argument(
+            '--pareto',
+            type=float,
+            default=1.16,
+            help=('Shape of the Pareto weights of the authors by posts and '
+                  'by followers, the smaller the more skewed.'),
+        )
+        parser.add_argument(
+            '--viral-posts',
+            type=int,
+            default=5,
+            help='Number of the posts collecting the viral share.',
+        )
+        parser.add_argument(
+            '--viral-share',
+            type=float,
+            default=0.3,
+            help='Share of all comments left to the viral posts.',
+        )
+        parser.add_argument(
+            '--grouped',
+            type=float,
+            default=0.7,
+            help='Share of the posts published in a group.',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=10000,
+            help='Number of the rows inserted by one transaction.',
+        )
+        parser.add_argument(
+            '--prefix',
+            default='synthetic_',
+            help='Prefix of the names of the users and the groups.',
+        )
+        parser.add_argument(
+            '--seed',
+            type=int,
+            help='Seed of the random generator to repeat the data.',
+        )
+        parser.add_argument(
+            '--skip-timelines',
+            action='store_true',
+            help=('Leave the follow timelines empty, allowed unless '
+                  'FOLLOW_FEED_ENGINE is timeline.'),
+        )
+
+    def insert(self, name, model, objects, total, **kwargs):
+        """Insert the objects by transactions of batch_size rows.
+
+        Yield the inserted objects of the batches one by one.
+        """
+        start = perf_counter()
+        done = 0
+        while done < total:
+            size = min(self.batch_size, total - done)
+            with transaction.atomic():
+                batch = model.objects.bulk_create(
+                    [next(objects) for _ in range(size)], **kwargs)
+            done += size
+            yield from batch
+        elapsed = perf_counter() - start
+        self.stdout.write(
+            f'{name}: {done} in {elapsed:.1f} s, '
+            f'{done / max(elapsed, 1e-6):.0f} rows/s'
+        )
+
+    def weights(self, count, shape):
+        """Return the cumulative Pareto weights of count items."""
+        return list(accumulate(
+            random.paretovariate(shape) for _ in range(count)))
+
+    def create_users(self, total):
+        password = make_password(None)
+        users = (
+            User(username=f'{self.prefix}{number}', password=password)
+            for number in range(total)
+        )
+        return array('q', (
+            user.pk for user in self.insert('users', User, users, total)))
+
+    def create_groups(self, total):
+        groups = (
+            Group(
+                title=f'Группа {self.prefix}{number}',
+                slug=f'{self.prefix}{number}',
+                description=text(12),
+            )
+            for number in range(total)
+        )
+        return array('q', (
+            group.pk for group in self.insert('groups', Group, groups, total)))
+
+    def create_posts(self, total, users, groups, options):
+        # Every author has own activity, a few write most of the posts.
+        activity = self.weights(len(users), options['pareto'])
+        span = max(options['days'], 1) * DAY
+        grouped = options['grouped'] if groups else 0
+
+        def posts():
+            # The posts come as the Poisson process, so the later posts get
+            # the greater pk like the real ones and the indexes of the
+            # dates are appended to.
+            published = self.now - span
+            while True:
+                authors = random.choices(
+                    users, cum_weights=activity, k=self.batch_size)
+                for author_id in authors:
+                    published += random.expovariate(total / span)
+                    yield Post(
+                        text=text(int(random.lognormvariate(3, 0.8)) + 1),
+                        author_id=author_id,
+                        group_id=(random.choice(groups)
+                                  if random.random() < grouped else None),
+                        pub_date=moment(min(published, self.now)),
+                    )
+
+        ids, dates = array('q'), array('d')
+        for post in self.insert('posts', Post, posts(), total):
+            ids.append(post.pk)
+            dates.append(post.pub_date.timestamp())
+        return ids, dates
+
+    def create_comments(self, total, users, posts, options):
+        ids, dates = posts
+        viral = random.sample(
+            range(len(ids)), min(options['viral_posts'], len(ids)))
+        share = options['viral_share'] if viral else 0
+
+        def comments():
+            while True:
+                index = (random.choice(viral) if random.random() < share
+                         else random.randrange(len(ids)))
+                # The most of the comments come on the first days.
+                created = min(
+                    dates[index] + random.expovariate(1 / DAY), self.now)
+                yield Comment(
+                    text=text(int(random.lognormvariate(2, 0.7)) + 1),
+                    author_id=random.choice(users),
+                    post_id=ids[index],
+                    created=moment(created),
+                )
+
+        for _ in self.insert('comments', Comment, comments(), total):
+            pass
+        return [ids[index] for index in viral]
+
+    def create_follows(self, total, users, options):
+        # Every author has own popularity, a few get most of the followers.
+        popularity = self.weights(len(users), options['pareto'])
+
+        def follows():
+            while True:
+                authors = random.choices(
+                    users, cum_weights=popularity, k=self.batch_size)
+                for author_id in authors:
+                    user_id = random.choice(users)
+                    if user_id != author_id:
+                        yield Follow(user_id=user_id, author_id=author_id)
+
+        # The repeated pairs are skipped, so fewer follows are stored.
+        stored = Follow.objects.count()
+        for _ in self.insert(
+                'follows', Follow, follows(), total, ignore_conflicts=True):
+            pass
+        self.stdout.write(
+            f'follows stored: {Follow.objects.count() - stored}')
+
+    def count_comments(self, posts):
+        """Store the number of the comments of the new posts."""
+        ids, _ = posts
+        if not ids:
+            return
+        comments = Comment.objects.filter(
+            post=OuterRef('pk')
+        ).order_by().values('post').annotate(
+            total=Count('pk')
+        ).values('total')
+        Post.objects.filter(pk__gte=min(ids), pk__lte=max(ids)).update(
+            comment_count=Coalesce(Subquery(comments), 0))
+
+    def handle(self, *args, **options):
+        random.seed(options['seed'])
+        self.batch_size = max(options['batch_size'], 1)
+        self.prefix = options['prefix']
+        self.now = time()
+        if User.objects.filter(username__startswith=self.prefix).exists():
+            raise CommandError(
+                f'There are users named {self.prefix}*, '
+                'choose another --prefix.')
+        if options['users'] < 2:
+            raise CommandError('At least two users are needed.')
+        if options['comments'] and not options['posts']:
+            raise CommandError('The comments need posts.')
+        if (options['skip_timelines']
+                and settings.FOLLOW_FEED_ENGINE == 'timeline'):
+            raise CommandError(
+                'The timeline engine needs the timelines, '
+                'drop --skip-timelines.')
+        start = perf_counter()
+        users = self.create_users(options['users'])
+        groups = self.create_groups(options['groups'])
+        with explicit_dates(
+                Post._meta.get_field('pub_date'),
+                Comment._meta.get_field('created')):
+            posts = self.create_posts(
+                options['posts'], users, groups, options)
+            viral = self.create_comments(
+                options['comments'], users, posts, options)
+        self.create_follows(options['follows'], users, options)
+        self.count_comments(posts)
+        # bulk_create sends no signals, so the timelines are not filled
+        # by the follows and the new posts.
+        if not options['skip_timelines']:
+            self.stdout.write(f'timelines: {feeds.rebuild()}')
+        total = counters.rebuild()
+        self.stdout.write(f'counters: {total}')
+        cache.invalidate(['feed'])
+        self.stdout.write(f'viral posts: {", ".join(map(str, viral))}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Generated in {perf_counter() - start:.1f} s'))
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from posts.cache import page_stats
+
+
+class Command(BaseCommand):
+    help = 'Show hits, misses and the hit rate of the shared page cache.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'key_prefix',
+            nargs='*',
+            default=['index_page', 'group_page'],
+            help='Key prefixes of the cached pages.',
+        )
+
+    def handle(self, *args, **options):
+        for key_prefix in options['key_prefix']:
+            stats = page_stats(key_prefix)
+            self.stdout.write(
+                f'{key_prefix}: hits {stats["hits"]}, '
+                f'misses {stats["misses"]}, '
+                f'hit rate {stats["hit_rate"]:.2%}'
+            )
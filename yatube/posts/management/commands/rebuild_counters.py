@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from posts.counters import rebuild
+
+
+class Command(BaseCommand):
+    help = 'Rebuild all post counters of the feeds from aggregates.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Number of counters inserted by one query.',
+        )
+
+    def handle(self, *args, **options):
+        total = rebuild(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {total} counters.'))
@@ -0,0 +1,20 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from posts.feeds import rebuild
+
+
+class Command(BaseCommand):
+    help = 'Fill the follow timelines of all users from the subscriptions.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--limit',
+            type=int,
+            default=settings.FEED_BACKFILL_COUNT,
+            help='Number of the latest posts taken from every author.',
+        )
+
+    def handle(self, *args, **options):
+        total = rebuild(limit=options['limit'])
+        self.stdout.write(self.style.SUCCESS(f'Timelines hold {total} posts.'))
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+
+from posts.counters import STATS_FIELDS, stats_drift
+from posts.models import AuthorStats
+
+
+class Command(BaseCommand):
+    help = 'Find and fix the drift of the author stats shown on the cards.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Only report the drift.',
+        )
+
+    def handle(self, *args, **options):
+        drifted = []
+        for stats, values in stats_drift():
+            self.stdout.write(f'{stats.user_id}: ' + ', '.join(
+                f'{field} {getattr(stats, field)} -> {value}'
+                for field, value in values.items()
+            ))
+            for field, value in values.items():
+                setattr(stats, field, value)
+            drifted.append(stats)
+        if drifted and not options['dry_run']:
+            AuthorStats.objects.bulk_update(
+                drifted, STATS_FIELDS, batch_size=1000)
+        self.stdout.write(self.style.SUCCESS(
+            f'Drifted stats: {len(drifted)}'
+            + (' (not fixed)' if options['dry_run'] else '')
+        ))
@@ -0,0 +1,84 @@
+import os
+from multiprocessing import get_context
+from time import perf_counter
+
+from django.core.management.base import BaseCommand
+
+from posts.models import Post
+from posts.thumbnails import (
+    collect_items, make_thumbnails, mark_ready, store_items,
+)
+
+
+class Command(BaseCommand):
+    help = ('Make the thumbnails of all post images by the pool of '
+            'processes. The run interrupted at pk N is resumed with '
+            '--after N.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=os.cpu_count(),
+            help='Number of the processes, all cores by default.',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=100,
+            help='Number of the posts read and stored at once.',
+        )
+        parser.add_argument(
+            '--after',
+            type=int,
+            default=0,
+            help='Start after the post with this pk.',
+        )
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help='Make the existing thumbnail files again.',
+        )
+
+    def chunks(self, after, size):
+        posts = Post.objects.exclude(image='').exclude(image=None).order_by(
+            'pk').values_list('pk', 'image')
+        while True:
+            chunk = list(posts.filter(pk__gt=after)[:size])
+            if not chunk:
+                return
+            after = chunk[-1][0]
+            yield chunk
+
+    def handle(self, *args, **options):
+        workers = max(options['workers'], 1)
+        force = options['force']
+        done = 0
+        errors = {}
+        start = perf_counter()
+        with get_context('fork').Pool(workers, collect_items) as pool:
+            for chunk in self.chunks(options['after'], options['chunk_size']):
+                # Every process gets its own slice of the chunk.
+                slices = [(dict(chunk[number::workers]), force)
+                          for number in range(min(workers, len(chunk)))]
+                items, variants = {}, {}
+                for collected in pool.starmap(make_thumbnails, slices):
+                    items.update(collected[0])
+                    variants.update(collected[1])
+                    errors.update(collected[2])
+                store_items(items)
+                mark_ready(variants)
+                done += len(chunk)
+                elapsed = perf_counter() - start
+                self.stdout.write(
+                    f'{done} posts up to pk {chunk[-1][0]}, '
+                    f'{done / elapsed:.1f} posts/s'
+                )
+        elapsed = perf_counter() - start
+        for pk, error in sorted(errors.items()):
+            self.stderr.write(f'{pk}: {error}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Regenerated posts: {done - len(errors)} in {elapsed:.1f} s'))
+        if errors:
+            self.stdout.write(self.style.WARNING(
+                f'Failed posts: {len(errors)}'))
@@ -0,0 +1,28 @@
+import sqlite3
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from posts.routers import PRIMARY
+
+
+class Command(BaseCommand):
+    help = ('Copy the default SQLite database into the files of '
+            'DATABASE_REPLICAS, standing in for the replication locally.')
+
+    def handle(self, *args, **options):
+        primary = connections[PRIMARY]
+        if primary.vendor != 'sqlite':
+            raise CommandError('Only SQLite databases can be copied.')
+        primary.ensure_connection()
+        for alias in settings.DATABASE_REPLICAS:
+            connections[alias].close()
+            replica = sqlite3.connect(connections[alias].settings_dict['NAME'])
+            try:
+                primary.connection.backup(replica)
+            finally:
+                replica.close()
+            self.stdout.write(f'{alias}: copied')
+        self.stdout.write(self.style.SUCCESS(
+            f'Synced replicas: {len(settings.DATABASE_REPLICAS)}'))
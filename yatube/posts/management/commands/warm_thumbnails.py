@@ -0,0 +1,50 @@
+from time import sleep
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from posts.models import Post
+from posts.thumbnails import generate, pending
+
+
+class Command(BaseCommand):
+    help = ('Make the missing thumbnails of the post images. With --watch '
+            'work as the background worker for the new images.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all',
+            action='store_true',
+            help='Make the thumbnails of the posts marked as ready too.',
+        )
+        parser.add_argument(
+            '--watch',
+            action='store_true',
+            help='Wait for new images instead of exiting.',
+        )
+
+    def warm(self, posts, failed):
+        warmed = 0
+        for post in posts.select_related('author', 'group').iterator():
+            if post.pk in failed:
+                continue
+            try:
+                warmed += generate(post)
+            except OSError as error:
+                failed.add(post.pk)
+                self.stderr.write(f'{post.pk}: {error}')
+        return warmed
+
+    def handle(self, *args, **options):
+        failed = set()
+        if options['all']:
+            posts = Post.objects.exclude(image='').exclude(image=None)
+        else:
+            posts = pending()
+        warmed = self.warm(posts, failed)
+        self.stdout.write(self.style.SUCCESS(f'Warmed posts: {warmed}'))
+        while options['watch']:
+            # The failed posts stay pending, they must not fill the batch.
+            posts = pending().exclude(pk__in=failed)
+            if not self.warm(posts[:settings.THUMBNAIL_BATCH], failed):
+                sleep(settings.THUMBNAIL_POLL_INTERVAL)
@@ -0,0 +1,53 @@
+from time import time
+
+from django.conf import settings
+from django.db import connection
+
+from . import routers
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS', 'TRACE')
+# The time until which the reads of the user stay on the primary.
+PRIMARY_COOKIE = 'primary_until'
+
+
+def write_lock(get_response):
+    """Start the transaction of the unsafe request with the write lock.
+
+    See posts.db_backend; the other database backends ignore the flag.
+    """
+    def middleware(request):
+        connection.begin_immediate = request.method not in SAFE_METHODS
+        try:
+            return get_response(request)
+        finally:
+            connection.begin_immediate = False
+    return middleware
+
+
+def read_your_writes(get_response):
+    """Keep the reads of the user on the primary for a while after a write.
+
+    The unsafe requests are served by the primary as a whole. The rows
+    created lazily by a page view pin nobody, see routers.side_writes.
+    """
+    def middleware(request):
+        try:
+            pinned = float(request.COOKIES.get(PRIMARY_COOKIE, 0)) > time()
+        except ValueError:
+            pinned = False
+        routers.start_request(
+            pinned or request.method not in SAFE_METHODS)
+        try:
+            response = get_response(request)
+        finally:
+            wrote = routers.finish_request()
+        if wrote:
+            response.set_cookie(
+                PRIMARY_COOKIE,
+                str(time() + settings.READ_YOUR_WRITES_TTL),
+                max_age=settings.READ_YOUR_WRITES_TTL,
+                httponly=True,
+                samesite='Lax',
+            )
+        return response
+    return middleware
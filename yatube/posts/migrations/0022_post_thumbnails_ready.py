@@ -0,0 +1,30 @@
+# Generated by Django 4.0.6 on 2026-10-18 09:10
+
+from django.db import migrations, models
+
+
+def mark_existing(apps, schema_editor):
+    # The existing images are shown at once, their thumbnails are made on
+    # the render like before.
+    Post = apps.get_model('posts', 'Post')
+    Post.objects.update(thumbnails_ready=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0021_authorstats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='thumbnails_ready',
+            field=models.BooleanField(default=False, editable=False, verbose_name='Миниатюры готовы'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(condition=models.Q(('thumbnails_ready', False)), fields=['pub_date'], name='post_thumbnails_pending_idx'),
+        ),
+        migrations.RunPython(mark_existing, migrations.RunPython.noop),
+    ]
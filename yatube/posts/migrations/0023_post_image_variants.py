@@ -0,0 +1,18 @@
+# Generated by Django 4.0.6 on 2026-10-18 11:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0022_post_thumbnails_ready'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='image_variants',
+            field=models.JSONField(default=dict, editable=False, help_text='Миниатюры изображения по форматам и ширине', verbose_name='Варианты изображения'),
+        ),
+    ]
@@ -67,11 +67,72 @@ class Post(models.Model):
         null=True,
         help_text='Загрузите изображение',
     )
+    image_width = models.PositiveIntegerField(
+        null=True,
+        blank=True,
+        editable=False,
+        verbose_name='Ширина изображения',
+    )
+    image_height = models.PositiveIntegerField(
+        null=True,
+        blank=True,
+        editable=False,
+        verbose_name='Высота изображения',
+    )
+    image_bytes = models.PositiveIntegerField(
+        null=True,
+        blank=True,
+        editable=False,
+        verbose_name='Размер изображения, байт',
+    )
+    comment_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Число комментариев',
+    )
+    thumbnails_ready = models.BooleanField(
+        default=False,
+        editable=False,
+        verbose_name='Миниатюры готовы',
+    )
+    image_variants = models.JSONField(
+        default=dict,
+        editable=False,
+        verbose_name='Варианты изображения',
+        help_text='Миниатюры изображения по форматам и ширине',
+    )
 
     class Meta:
         verbose_name = 'Пост'
         verbose_name_plural = 'Посты'
         ordering = ('-pub_date',)
+        # SQLite appends rowid to every index and scans it backwards for
+        # DESC ordering, so ascending indexes serve '-pub_date', '-pk'.
+        indexes = (
+            models.Index(
+                fields=('pub_date',),
+                name='post_pub_date_idx',
+            ),
+            models.Index(
+                fields=('author', 'pub_date'),
+                name='post_author_pub_date_idx',
+            ),
+            models.Index(
+                fields=('group', 'pub_date'),
+                name='post_group_pub_date_idx',
+            ),
+            # Only the posts waiting for the thumbnails (posts.thumbnails).
+            models.Index(
+                fields=('pub_date',),
+                name='post_thumbnails_pending_idx',
+                condition=Q(thumbnails_ready=False),
+            ),
+            # The posts sharing the image are looked up on its release.
+            models.Index(
+                fields=('image',),
+                name='post_image_idx',
+            ),
+        )
 
     def __str__(self):
         return self.text[:15]
@@ -103,6 +164,12 @@ class Comment(models.Model):
         verbose_name = 'Комментарий'
         verbose_name_plural = 'Комментарии'
         ordering = ('-created',)
+        indexes = (
+            models.Index(
+                fields=('post', 'created'),
+                name='comment_post_created_idx',
+            ),
+        )
 
     def __str__(self):
         return self.text[:15]
@@ -136,3 +203,89 @@ class Follow(models.Model):
                 name='nama_not_author',
             )
         )
+
+
+class Counter(models.Model):
+    name = models.CharField(
+        max_length=64,
+        unique=True,
+        verbose_name='Счётчик',
+        help_text=('Область подсчёта: posts, group:<id>, author:<id> '
+                   'или feed:<id>.'),
+    )
+    value = models.BigIntegerField(
+        default=0,
+        verbose_name='Значение',
+    )
+
+    class Meta:
+        verbose_name = 'Счётчик'
+        verbose_name_plural = 'Счётчики'
+        ordering = ('name',)
+
+    def __str__(self):
+        return f'{self.name}={self.value}'
+
+
+class FeedItem(models.Model):
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        verbose_name='Пользователь',
+        related_name='feed_items',
+    )
+    post = models.ForeignKey(
+        Post,
+        on_delete=models.CASCADE,
+        verbose_name='Пост',
+        related_name='feed_items',
+    )
+    pub_date = models.DateTimeField(
+        verbose_name='Дата публикации',
+    )
+
+    class Meta:
+        verbose_name = 'Запись ленты'
+        verbose_name_plural = 'Записи ленты'
+        ordering = ('-pub_date',)
+        constraints = (
+            models.UniqueConstraint(
+                fields=('user', 'post'),
+                name='unique_user_post',
+            ),
+        )
+        indexes = (
+            models.Index(
+                fields=('user', 'pub_date', 'post'),
+                name='feed_user_pub_date_post_idx',
+            ),
+        )
+
+
+class AuthorStats(models.Model):
+    user = models.OneToOneField(
+        User,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        verbose_name='Пользователь',
+        related_name='stats',
+    )
+    posts = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Записей',
+    )
+    followers = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Подписчиков',
+    )
+    following = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Подписок',
+    )
+
+    class Meta:
+        verbose_name = 'Статистика автора'
+        verbose_name_plural = 'Статистика авторов'
+
+    def __str__(self):
+        return f'{self.user}: {self.posts}/{self.followers}/{self.following}'
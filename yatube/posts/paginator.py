@@ -1,5 +1,177 @@
-from django.core.paginator import Paginator
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from binascii import Error as DecodeError
+from datetime import datetime
+
+from django.core.paginator import Page, Paginator
 from django.conf import settings
+from django.db.models import Q
+from django.utils.functional import cached_property
+
+from .counters import get_count
+
+
+def encode_cursor(obj, keys=('pub_date', 'pk')):
+    """Return an opaque token pointing at the object's keys."""
+    moment, pk = (getattr(obj, key) for key in keys)
+    raw = f'{moment.isoformat()}|{pk}'.encode()
+    return urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    """Return (datetime, pk) from the token or None if it is malformed."""
+    if not token:
+        return None
+    try:
+        raw = urlsafe_b64decode(token + '=' * (-len(token) % 4)).decode()
+        moment, pk = raw.split('|')
+        return datetime.fromisoformat(moment), int(pk)
+    except (DecodeError, UnicodeDecodeError, ValueError):
+        return None
+
+
+class CursorPage(Page):
+    """Page of the CursorPaginator.
+
+    It knows nothing about its number and the total count, only whether
+    there are neighbours and the tokens leading to them.
+    """
+
+    def __init__(self, object_list, paginator, has_previous, has_next):
+        super().__init__(object_list, None, paginator)
+        self._has_previous = has_previous
+        self._has_next = has_next
+        keys = paginator.keys
+        self.previous_cursor = (
+            encode_cursor(object_list[0], keys)
+            if has_previous and object_list else None
+        )
+        self.next_cursor = (
+            encode_cursor(object_list[-1], keys)
+            if has_next and object_list else None
+        )
+
+    def __repr__(self):
+        return f'<Page after {self.paginator.after}>'
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_next(self):
+        return self._has_next
+
+
+class CursorPaginator(Paginator):
+    """Keyset paginator over the (date, pk) pair, newest first.
+
+    The page is selected by the 'after' or 'before' token, so the query is
+    a single indexed range scan with LIMIT: neither OFFSET nor COUNT(*) are
+    executed and the cost does not depend on how deep the page is.
+    The keys are ('pub_date', 'pk') unless the queryset is explicitly
+    ordered by another pair of descending fields.
+    """
+
+    keys = ('pub_date', 'pk')
+
+    def __init__(self, object_list, per_page, after=None, before=None):
+        super().__init__(object_list, per_page)
+        self.after = decode_cursor(after)
+        self.before = None if self.after else decode_cursor(before)
+        ordering = getattr(self.queryset, 'query', None)
+        ordering = ordering.order_by if ordering else ()
+        if len(ordering) == 2:
+            self.keys = tuple(field.lstrip('-') for field in ordering)
+
+    @property
+    def queryset(self):
+        # Sequences like posts.feeds.MergedFeed are paged by their queryset.
+        return getattr(self.object_list, 'fallback', self.object_list)
+
+    @property
+    def page_range(self):
+        return range(0)
+
+    def _seek(self, lookup, cursor):
+        (date, key), (moment, pk) = self.keys, cursor
+        return (
+            Q(**{f'{date}__{lookup}': moment})
+            | Q(**{date: moment, f'{key}__{lookup}': pk})
+        )
+
+    def _fetch(self, queryset, *ordering):
+        return list(queryset.order_by(*ordering)[:self.per_page + 1])
+
+    def get_page(self, number=None):
+        queryset = self.queryset
+        date, key = self.keys
+        if self.before:
+            rows = self._fetch(
+                queryset.filter(self._seek('gt', self.before)),
+                date,
+                key,
+            )
+            if rows:
+                has_previous = len(rows) > self.per_page
+                rows = rows[:self.per_page][::-1]
+                return CursorPage(rows, self, has_previous, True)
+        after = self.after
+        if after:
+            queryset = queryset.filter(self._seek('lt', after))
+        rows = self._fetch(queryset, f'-{date}', f'-{key}')
+        has_next = len(rows) > self.per_page
+        return CursorPage(rows[:self.per_page], self, bool(after), has_next)
+
+    page = get_page
+
+
+class CountedPaginator(Paginator):
+    """Paginator which takes the total from the counter, not COUNT(*)."""
+
+    def __init__(self, object_list, per_page, counter):
+        super().__init__(object_list, per_page)
+        self.counter = counter
+
+    @cached_property
+    def count(self):
+        return get_count(self.counter)
+
+
+class CappedPaginator(Paginator):
+    """Paginator counting settings.ADMIN_COUNT_LIMIT objects at most.
+
+    The count is the COUNT(*) of the unordered subquery with LIMIT, so it
+    stops early on the huge tables, the pages past the limit are not
+    offered.
+    """
+
+    @cached_property
+    def counted(self):
+        return self.object_list.order_by()[
+            :settings.ADMIN_COUNT_LIMIT + 1].count()
+
+    @cached_property
+    def count(self):
+        return min(self.counted, settings.ADMIN_COUNT_LIMIT)
+
+    @property
+    def capped(self):
+        return self.counted > settings.ADMIN_COUNT_LIMIT
+
+
+def page_links(number, num_pages, from_page, to_page):
+    """Return the page numbers to draw, None stands for an ellipsis.
+
+    The list is the first page, the window from_page..to_page and the last
+    page, so its length does not depend on the number of pages.
+    """
+    links = [1]
+    if from_page > 2:
+        links.append(None)
+    links.extend(range(from_page, to_page + 1))
+    if to_page < num_pages - 1:
+        links.append(None)
+    if num_pages > 1:
+        links.append(num_pages)
+    return links
 
 
 def my_paginator(
@@ -7,18 +179,43 @@ def my_paginator(
         page_number,
         delta_count=settings.DELTA_PAGE_COUNT,
         count=settings.MAX_PAGE_COUNT,
+        after=None,
+        before=None,
+        counter=None,
+        numbered=False,
 ):
     """Return dictionary of variables for the paginator.
 
     It is necessary to display the first, last page, the current one and 'delta_count' pages before and after current
-    one. 'count' is a maximum posts per page.
+    one. 'count' is a maximum posts per page. The numbers to draw are
+    returned in 'page_links'.
+    If settings.CURSOR_PAGINATION is on or the 'after'/'before' token is
+    passed, the page is taken by the CursorPaginator and page numbers are
+    not shown at all.
+    If the 'counter' name is passed, the total is read from the counter
+    (see posts.counters) instead of COUNT(*).
+    The pages of the lists not ordered by the date, like the search
+    results, are always 'numbered'.
     """
-    paginator = Paginator(page_list, count)
+    if not numbered and (settings.CURSOR_PAGINATION or after or before):
+        paginator = CursorPaginator(page_list, count, after, before)
+        return {
+            'from_page': None,
+            'to_page': None,
+            'page_links': [],
+            'page': paginator.get_page(),
+        }
+    if counter:
+        paginator = CountedPaginator(page_list, count, counter)
+    else:
+        paginator = Paginator(page_list, count)
     page = paginator.get_page(page_number)
     from_page = max(page.number - delta_count, 2)
     to_page = min(page.number + delta_count, paginator.num_pages - 1)
     return {
         'from_page': from_page,
         'to_page': to_page,
+        'page_links': page_links(
+            page.number, paginator.num_pages, from_page, to_page),
         'page': page,
     }
@@ -0,0 +1,82 @@
+"""Database router sending the reads of the requests to the replicas.
+
+The replicas are the aliases of settings.DATABASE_REPLICAS. All writes go
+to the default database, the primary. The reads of a request go to a
+random replica unless the request is pinned to the primary, which
+posts.middleware.read_your_writes does for READ_YOUR_WRITES_TTL seconds
+after the user wrote, or the request has written itself. Outside of the
+requests (commands, the thumbnails worker) everything stays on the
+primary.
+"""
+import random
+from contextlib import contextmanager
+from threading import local
+
+from django.conf import settings
+
+PRIMARY = 'default'
+# Their reads must see the writes at once: the session of the new login.
+PRIMARY_APPS = ('sessions',)
+
+state = local()
+
+
+def start_request(pinned):
+    """Route the reads of the request of the thread to the replicas."""
+    state.replicas = not pinned
+    state.wrote = False
+
+
+def finish_request():
+    """Return whether the request wrote and route it all to the primary."""
+    wrote = getattr(state, 'wrote', False)
+    state.replicas = state.wrote = False
+    return wrote
+
+
+@contextmanager
+def primary(pinned=True):
+    """Route the reads inside to the primary if pinned."""
+    replicas = getattr(state, 'replicas', False)
+    if pinned:
+        state.replicas = False
+    try:
+        yield
+    finally:
+        state.replicas = replicas
+
+
+@contextmanager
+def side_writes():
+    """Keep the writes inside from pinning the user to the primary.
+
+    The rows created lazily by the reads, like the counters, are not the
+    writes of the user; the reads inside still see them.
+    """
+    wrote = getattr(state, 'wrote', False)
+    try:
+        yield
+    finally:
+        state.wrote = wrote
+
+
+class ReplicaRouter:
+
+    def db_for_read(self, model, **hints):
+        if (not settings.DATABASE_REPLICAS
+                or not getattr(state, 'replicas', False)
+                or getattr(state, 'wrote', False)
+                or model._meta.app_label in PRIMARY_APPS):
+            return PRIMARY
+        return random.choice(settings.DATABASE_REPLICAS)
+
+    def db_for_write(self, model, **hints):
+        # The later reads of the request must see the write.
+        state.wrote = True
+        return PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, **hints):
+        return db == PRIMARY
@@ -0,0 +1,137 @@
+"""Full-text search of the posts by the SQLite FTS5 index.
+
+posts_post_search is the external content FTS5 table of posts_post.text: it
+keeps only the index, the text is read from posts_post. The triggers of the
+migration 0026_post_search keep it in sync with every insert, update and
+delete of the posts, the bulk and raw ones too. The SQLite schema editor
+rebuilds the table it alters and drops its triggers on the way, so they are
+created again after every migrate (install).
+
+All words of the query must be found, the last one as a prefix. Only the
+newest settings.SEARCH_MAX_RESULTS matches are counted and ordered by the
+bm25 rank: the index yields the matches by the rowid, so the cost of the
+count and of every page depends on the cap, neither on the number of the
+posts nor on the matches of a common word.
+"""
+import re
+
+from django.conf import settings
+from django.db import connections, router
+from django.db.models.expressions import RawSQL
+
+from .feeds import index_feed
+from .models import Post
+
+TABLE = 'posts_post_search'
+WORDS = re.compile(r'\w+')
+TRIGGERS = {
+    f'{TABLE}_insert': f'''
+    AFTER INSERT ON posts_post BEGIN
+        INSERT INTO {TABLE} (rowid, text) VALUES (new.id, new.text);
+    END''',
+    f'{TABLE}_delete': f'''
+    AFTER DELETE ON posts_post BEGIN
+        INSERT INTO {TABLE} ({TABLE}, rowid, text)
+        VALUES ('delete', old.id, old.text);
+    END''',
+    f'{TABLE}_update': f'''
+    AFTER UPDATE OF text ON posts_post BEGIN
+        INSERT INTO {TABLE} ({TABLE}, rowid, text)
+        VALUES ('delete', old.id, old.text);
+        INSERT INTO {TABLE} (rowid, text) VALUES (new.id, new.text);
+    END''',
+}
+MATCHES = f'SELECT rowid FROM {TABLE} WHERE {TABLE} MATCH %s'
+RANKED = (
+    f'SELECT rowid FROM (SELECT rowid, rank FROM {TABLE} '
+    f'WHERE {TABLE} MATCH %s ORDER BY rowid DESC LIMIT %s) '
+    'ORDER BY rank LIMIT %s OFFSET %s'
+)
+
+
+def match_expression(query):
+    """Return the FTS5 query of the words of the text or None.
+
+    Every word is quoted, so the syntax of FTS5 typed by the user is
+    searched as the plain words.
+    """
+    words = WORDS.findall(query)[:settings.SEARCH_MAX_WORDS]
+    if not words:
+        return None
+    return ' '.join(f'"{word}"' for word in words) + '*'
+
+
+def filter_posts(queryset, query):
+    """Return the posts of the queryset matching the query."""
+    expression = match_expression(query)
+    if expression is None:
+        return queryset.none()
+    return queryset.filter(pk__in=RawSQL(MATCHES, (expression,)))
+
+
+def install(connection):
+    """Create the dropped triggers and rebuild the index after them.
+
+    The posts changed while the triggers were missing are indexed again,
+    so the index is rebuilt only in that case. Nothing is done before the
+    index is migrated.
+    """
+    if TABLE not in connection.introspection.table_names():
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'trigger' "
+            "AND tbl_name = 'posts_post' AND name LIKE %s",
+            (f'{TABLE}_%',),
+        )
+        missing = TRIGGERS.keys() - {name for name, in cursor.fetchall()}
+        for name in missing:
+            cursor.execute(f'CREATE TRIGGER {name} {TRIGGERS[name]}')
+        if missing:
+            cursor.execute(
+                f"INSERT INTO {TABLE} ({TABLE}) VALUES ('rebuild')")
+    return bool(missing)
+
+
+class SearchResults:
+    """Posts matching the query, the best ones first.
+
+    The object quacks like a sequence, so Paginator handles it as a
+    queryset: the count and every slice are read from the index and only
+    the posts of the page are read from posts_post.
+    """
+
+    def __init__(self, query):
+        self.expression = match_expression(query)
+
+    def execute(self, sql, params):
+        connection = connections[router.db_for_read(Post)]
+        with connection.cursor() as cursor:
+            cursor.execute(sql, (self.expression, *params))
+            return cursor.fetchall()
+
+    def count(self):
+        if self.expression is None:
+            return 0
+        (count,), = self.execute(
+            f'SELECT count(*) FROM ({MATCHES} LIMIT %s)',
+            (settings.SEARCH_MAX_RESULTS,),
+        )
+        return count
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice):
+            return self[key:key + 1][0]
+        start = key.start or 0
+        stop = min(key.stop, settings.SEARCH_MAX_RESULTS)
+        if self.expression is None or start >= stop:
+            return []
+        ids = [pk for pk, in self.execute(
+            RANKED,
+            (settings.SEARCH_MAX_RESULTS, stop - start, start),
+        )]
+        posts = index_feed().in_bulk(ids)
+        return [posts[pk] for pk in ids if pk in posts]
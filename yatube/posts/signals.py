@@ -0,0 +1,179 @@
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.backends.signals import connection_created
+from django.db.models import F
+from django.db.models.signals import (post_delete, post_migrate, post_save,
+                                      pre_delete, pre_save)
+from django.dispatch import receiver
+
+from . import cache, counters, feeds, search, thumbnails
+from .models import Comment, Follow, Group, Post
+
+
+@receiver(connection_created)
+def tune_sqlite(sender, connection, **kwargs):
+    """Set settings.SQLITE_PRAGMAS on the new SQLite connection."""
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for name, value in settings.SQLITE_PRAGMAS.items():
+            cursor.execute(f'PRAGMA {name} = {value}')
+
+
+@receiver(post_migrate)
+def install_search(sender, using, **kwargs):
+    """Create the triggers of the search index dropped by the migrations."""
+    connection = connections[using]
+    if sender.name == 'posts' and connection.vendor == 'sqlite':
+        search.install(connection)
+
+
+@receiver(pre_save, sender=Post)
+def remember_post_group(sender, instance, **kwargs):
+    """Keep the stored group and image of the post to notice their change."""
+    instance._stored_group_id = instance._stored_image = None
+    if instance.pk:
+        instance._stored_group_id, instance._stored_image = (
+            Post.objects.filter(pk=instance.pk).values_list(
+                'group_id', 'image').first() or (None, None))
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def forget_author_posts(sender, instance, **kwargs):
+    """Drop the cached list of recent posts of the author."""
+    feeds.forget_author(instance.author_id)
+
+
+@receiver(post_save, sender=Post)
+def count_saved_post(sender, instance, created, **kwargs):
+    """Count and fan out the new post or move it between the groups."""
+    with transaction.atomic():
+        if created:
+            counters.change(counters.post_counter_names(instance), 1)
+            counters.shift_stats(instance.author_id, posts=1)
+            feeds.fan_out(instance)
+            return
+        if instance._stored_group_id != instance.group_id:
+            if instance._stored_group_id:
+                counters.change(
+                    [counters.counter_name(
+                        'group', instance._stored_group_id)],
+                    -1,
+                )
+            if instance.group_id:
+                counters.change(
+                    [counters.counter_name('group', instance.group_id)],
+                    1,
+                )
+
+
+@receiver(pre_delete, sender=Post)
+def withdraw_post(sender, instance, **kwargs):
+    """Uncount the post from the timelines it is delivered to."""
+    feeds.withdraw(instance)
+
+
+@receiver(post_delete, sender=Post)
+def count_deleted_post(sender, instance, **kwargs):
+    """Uncount the post from all counters which include it."""
+    counters.change(counters.post_counter_names(instance), -1)
+    counters.shift_stats(instance.author_id, posts=-1)
+
+
+@receiver(post_save, sender=Post)
+def release_replaced_image(sender, instance, **kwargs):
+    """Release the replaced image of the post after the commit."""
+    stored = getattr(instance, '_stored_image', None)
+    if stored and stored != instance.image.name:
+        transaction.on_commit(lambda: thumbnails.release(stored))
+
+
+@receiver(post_delete, sender=Post)
+def release_deleted_image(sender, instance, **kwargs):
+    """Release the image of the deleted post after the commit."""
+    name = instance.image.name
+    if name:
+        transaction.on_commit(lambda: thumbnails.release(name))
+
+
+@receiver(post_save, sender=Follow)
+def count_follow(sender, instance, created, **kwargs):
+    """Backfill the timeline of the user and count the subscription."""
+    if created:
+        feeds.backfill(instance.user_id, instance.author_id)
+        counters.shift_stats(instance.author_id, followers=1)
+        counters.shift_stats(instance.user_id, following=1)
+
+
+@receiver(post_delete, sender=Follow)
+def count_unfollow(sender, instance, **kwargs):
+    """Prune the timeline of the user and uncount the subscription."""
+    feeds.prune(instance.user_id, instance.author_id)
+    counters.shift_stats(instance.author_id, followers=-1)
+    counters.shift_stats(instance.user_id, following=-1)
+
+
+@receiver(post_save, sender=Comment)
+def count_comment(sender, instance, created, **kwargs):
+    """Increase the number of comments of the post."""
+    if created:
+        Post.objects.filter(pk=instance.post_id).update(
+            comment_count=F('comment_count') + 1)
+
+
+@receiver(post_delete, sender=Comment)
+def uncount_comment(sender, instance, **kwargs):
+    """Decrease the number of comments of the post."""
+    Post.objects.filter(pk=instance.post_id).update(
+        comment_count=F('comment_count') - 1)
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def invalidate_post_pages(sender, instance, **kwargs):
+    """Bump the versions of the pages showing the post."""
+    scopes = cache.post_scopes(
+        instance.pk,
+        instance.author.username,
+        instance.group.slug if instance.group_id else None,
+    )
+    stored_group_id = getattr(instance, '_stored_group_id', None)
+    if stored_group_id and stored_group_id != instance.group_id:
+        scopes += [
+            f'group:{slug}' for slug in Group.objects.filter(
+                pk=stored_group_id).values_list('slug', flat=True)
+        ]
+    cache.invalidate(scopes)
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def invalidate_comment_pages(sender, instance, **kwargs):
+    """Bump the versions of the pages showing the commented post."""
+    names = Post.objects.filter(pk=instance.post_id).values_list(
+        'author__username', 'group__slug').first()
+    if names:
+        cache.invalidate(cache.post_scopes(instance.post_id, *names))
+
+
+@receiver(post_save, sender=Follow)
+@receiver(post_delete, sender=Follow)
+def invalidate_follow_pages(sender, instance, **kwargs):
+    """Bump the versions of the pages showing both sides' stats."""
+    cache.invalidate([
+        f'author:{instance.user.username}',
+        f'author:{instance.author.username}',
+    ])
+
+
+@receiver(post_save, sender=Group)
+def invalidate_group_pages(sender, instance, created, **kwargs):
+    """Bump the versions of the pages and the cards showing the group."""
+    scopes = ['feed', f'group:{instance.slug}']
+    if not created:
+        scopes += [
+            f'post:{pk}'
+            for pk in instance.posts.values_list('pk', flat=True)
+        ]
+    cache.invalidate(scopes)
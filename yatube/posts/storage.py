@@ -0,0 +1,49 @@
+"""Media storage naming the files by their content.
+
+The file is stored as <upload_to>/<ab>/<sha256><ext>, where ab are the
+first two hex digits of the hash, so the same bytes uploaded by many users
+are stored once, and the thumbnails made by sorl from the same name are
+shared by all posts of the image too. The file is deleted with its
+thumbnails only when no post refers to it anymore (thumbnails.release);
+the check and the deletion hold the write lock of the database, under which
+the upload looks the existing file up.
+"""
+import re
+from hashlib import sha256
+from os.path import splitext
+
+from django.core.files.storage import FileSystemStorage
+
+ADDRESSED = re.compile(r'(^|/)[0-9a-f]{2}/[0-9a-f]{64}(\.\w+)?$')
+
+
+def content_name(name, content):
+    """Return the name of the content under the directory of the name.
+
+    The name of the content is its own name under the same directory.
+    """
+    digest = sha256()
+    for chunk in content.chunks():
+        digest.update(chunk)
+    digest = digest.hexdigest()
+    directory, _, base = name.rpartition('/')
+    if is_addressed(name):
+        directory = directory.rpartition('/')[0]
+    extension = splitext(base)[1].lower()
+    return '/'.join(filter(None, (
+        directory, digest[:2], digest + extension)))
+
+
+def is_addressed(name):
+    """Tell if the file is already named by its content."""
+    return bool(ADDRESSED.search(name))
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """File system storage keeping one file of the same content."""
+
+    def _save(self, name, content):
+        name = content_name(name, content)
+        if self.exists(name):
+            return name
+        return super()._save(name, content)
@@ -0,0 +1,31 @@
+from django import template
+from django.utils.safestring import mark_safe
+
+from ..cache import hole_marker, render_hole, render_posts
+
+register = template.Library()
+
+
+@register.simple_tag(takes_context=True)
+def hole(context, template_name, **params):
+    """Render the viewer-specific template or punch a hole for it.
+
+    The template gets only the params and the context processors, so it
+    renders the same way inline and on the fill of the cached page.
+    """
+    request = context.get('request')
+    if getattr(request, 'punch_holes', False):
+        return mark_safe(hole_marker(template_name, params))
+    return render_hole(request, template_name, params)
+
+
+@register.simple_tag(takes_context=True)
+def post_cards(context, posts, paged=True):
+    """Render the cached cards of the posts of the page."""
+    return mark_safe(render_posts(context['request'], posts, paged))
+
+
+@register.simple_tag(takes_context=True)
+def post_card(context, post):
+    """Render the cached card of the single post."""
+    return mark_safe(render_posts(context['request'], [post], paged=False))
@@ -0,0 +1,33 @@
+from django import template
+from django.core.files.storage import default_storage
+
+from ..thumbnails import FALLBACK_WIDTH, FORMATS, SIZES
+
+register = template.Library()
+
+
+def srcset(variants):
+    return ', '.join(
+        f'{default_storage.url(name)} {width}w'
+        for name, width, _ in variants
+    )
+
+
+@register.inclusion_tag('includes/picture.html')
+def picture(variants):
+    """Render the <picture> of the stored variants of the post image."""
+    *sources, fallback = (image_format.lower() for image_format in FORMATS)
+    images = variants[fallback]
+    name, width, height = next(
+        (image for image in images if image[1] >= FALLBACK_WIDTH),
+        images[-1],
+    )
+    return {
+        'sources': [(f'image/{image_format}', srcset(variants[image_format]))
+                    for image_format in sources],
+        'srcset': srcset(images),
+        'sizes': SIZES,
+        'src': default_storage.url(name),
+        'width': width,
+        'height': height,
+    }
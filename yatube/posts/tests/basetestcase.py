@@ -3,10 +3,15 @@ from shutil import rmtree
 
 from django.conf import settings
 from django.core.files.uploadedfile import SimpleUploadedFile
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from django.urls import reverse
 
+from ..storage import is_addressed
 
+
+# Локальный кеш процесса не видит cache.clear() и откат базы между тестами,
+# его проверяют отдельно.
+@override_settings(LOCAL_CACHE_SIZE=0)
 class BaseTestCase(TestCase):
 
     @classmethod
@@ -42,8 +47,10 @@ class BaseTestCase(TestCase):
         )
 
     def assert_image_in_post(self, img, filename):
+        # Файл назван по содержимому, от имени остаётся расширение.
         _, head = path.split(img)
-        self.assertEqual(head, filename)
+        self.assertEqual(path.splitext(head)[1], path.splitext(filename)[1])
+        self.assertTrue(is_addressed(img))
 
     def assert_comment(self, comment, context):
         pk = context.get('pk')
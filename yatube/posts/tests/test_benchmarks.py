@@ -0,0 +1,35 @@
+import os
+import subprocess
+import sys
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+from django.conf import settings
+from django.test import SimpleTestCase
+
+from ..benchmarks import SCENARIOS
+
+
+class BenchmarkTestCase(SimpleTestCase):
+
+    def test_all_scenarios_run_in_one_go(self):
+        """Check the default run of the benchmark goes through."""
+        # Команда подменяет базу, поэтому запускается отдельным процессом,
+        # и чистит кеш, поэтому получает свой файл кеша.
+        with TemporaryDirectory() as directory:
+            result = subprocess.run(
+                [sys.executable, 'manage.py', 'benchmark', '--repeat', '1',
+                 '--scale', '0.001'],
+                cwd=settings.BASE_DIR,
+                env={
+                    **os.environ,
+                    'CACHE_LOCATION': str(Path(directory) / 'cache.sqlite3'),
+                },
+                capture_output=True,
+                text=True,
+                timeout=300,
+            )
+        self.assertEqual(result.returncode, 0, result.stderr[-2000:])
+        for name in SCENARIOS:
+            with self.subTest(scenario=name):
+                self.assertIn(f'{name}: ', result.stdout)
@@ -0,0 +1,107 @@
+from multiprocessing import get_context
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from time import sleep
+from unittest.mock import patch
+
+from django.test import SimpleTestCase
+
+from ..cache_backend import SQLiteCache
+
+
+def increment(location, times):
+    cache = SQLiteCache(location, {})
+    for _ in range(times):
+        cache.incr('counter')
+
+
+class SQLiteCacheTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.directory = TemporaryDirectory()
+        self.location = str(Path(self.directory.name) / 'cache.sqlite3')
+        self.cache = SQLiteCache(self.location, {'TIMEOUT': 60})
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_get_set_many(self):
+        """Check the plain operations of the cache."""
+        cache = self.cache
+        cache.set('one', {'value': 1})
+        cache.set_many({'two': 2, 'three': [3]})
+        self.assertEqual(cache.get('one'), {'value': 1})
+        self.assertEqual(
+            cache.get_many(['one', 'three', 'four']),
+            {'one': {'value': 1}, 'three': [3]},
+        )
+        self.assertFalse(cache.add('two', 22))
+        self.assertTrue(cache.add('four', 4))
+        self.assertEqual(cache.incr('two', 10), 12)
+        with self.assertRaises(ValueError):
+            cache.incr('five')
+        cache.delete_many(['one', 'two'])
+        self.assertIsNone(cache.get('one'))
+        self.assertTrue(cache.has_key('four'))
+        cache.clear()
+        self.assertEqual(cache.get('four', 'default'), 'default')
+
+    def test_expiration(self):
+        """Check that the expired entry is missing and can be added."""
+        cache = self.cache
+        cache.set('short', 1, 0.1)
+        cache.set('forever', 1, None)
+        sleep(0.2)
+        self.assertIsNone(cache.get('short'))
+        self.assertTrue(cache.add('short', 2))
+        self.assertEqual(cache.get_many(['short', 'forever']),
+                         {'short': 2, 'forever': 1})
+        cache.set('forever', 1, 0)
+        self.assertFalse(cache.has_key('forever'))
+
+    def test_least_recently_used_are_evicted(self):
+        """Check that the entries read recently survive the eviction."""
+        cache = SQLiteCache(
+            self.location,
+            {'OPTIONS': {
+                'MAX_ENTRIES': 4, 'CULL_FREQUENCY': 4, 'CULL_EVERY': 1}},
+        )
+        cache.set_many({f'key_{number}': number for number in range(4)})
+        sleep(0.01)
+        with patch('posts.cache_backend.TOUCH_RESOLUTION', 0):
+            cache.get('key_0')
+        cache.set('key_4', 4)
+        alive = cache.get_many([f'key_{number}' for number in range(5)])
+        self.assertEqual(len(alive), 4)
+        self.assertIn('key_0', alive)
+        self.assertIn('key_4', alive)
+
+    def test_entries_are_counted_once_in_cull_every_writes(self):
+        """Check that the writes do not count the entries every time."""
+        cache = SQLiteCache(
+            self.location,
+            {'OPTIONS': {
+                'MAX_ENTRIES': 2, 'CULL_FREQUENCY': 2, 'CULL_EVERY': 3}},
+        )
+        queries = []
+        cache.connection.set_trace_callback(queries.append)
+        for number in range(3):
+            cache.set(f'key_{number}', number)
+        counts = [query for query in queries if 'COUNT(*)' in query]
+        self.assertEqual(len(counts), 2)
+        self.assertEqual(
+            len(cache.get_many([f'key_{number}' for number in range(3)])), 2)
+
+    def test_incr_is_atomic_between_processes(self):
+        """Check that no increment is lost by the concurrent workers."""
+        self.cache.set('counter', 0)
+        context = get_context('fork')
+        workers = [
+            context.Process(target=increment, args=(self.location, 100))
+            for _ in range(4)
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        self.assertEqual(self.cache.get('counter'), 400)
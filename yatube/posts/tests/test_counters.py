@@ -0,0 +1,136 @@
+from io import StringIO
+
+from django.core.management import call_command
+from django.template.loader import render_to_string
+from django.test import TestCase
+
+from ..counters import (POSTS, author_stats, counted_queryset, counter_name,
+                        get_count)
+from ..models import AuthorStats, Counter, Follow, Group, Post, User
+from ..paginator import my_paginator
+
+
+class CountersTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create(username='author')
+        cls.reader = User.objects.create(username='reader')
+        cls.group = Group.objects.create(title='Группа', slug='group')
+        cls.other_group = Group.objects.create(title='Другая', slug='other')
+        Follow.objects.create(user=cls.reader, author=cls.author)
+        for count in range(3):
+            Post.objects.create(
+                text=f'Тест {count}',
+                author=cls.author,
+                group=cls.group,
+            )
+        cls.names = (
+            POSTS,
+            counter_name('group', cls.group.pk),
+            counter_name('group', cls.other_group.pk),
+            counter_name('author', cls.author.pk),
+            counter_name('feed', cls.reader.pk),
+        )
+
+    def setUp(self):
+        for name in self.names:
+            get_count(name)
+
+    def assert_counters(self):
+        for name in self.names:
+            with self.subTest(name=name):
+                self.assertEqual(
+                    get_count(name),
+                    counted_queryset(name).count()
+                )
+
+    def test_counters_follow_post_writes(self):
+        """Check counters after post creation, editing and deletion."""
+        post = Post.objects.create(
+            text='Новый',
+            author=self.author,
+            group=self.group,
+        )
+        self.assert_counters()
+        post.group = self.other_group
+        post.save()
+        self.assert_counters()
+        post.delete()
+        self.assert_counters()
+
+    def test_counters_follow_subscriptions(self):
+        """Check the follow feed counter after unfollow and follow."""
+        Follow.objects.filter(user=self.reader).delete()
+        self.assert_counters()
+        Follow.objects.create(user=self.reader, author=self.author)
+        self.assert_counters()
+
+    def test_paginator_does_not_count_rows(self):
+        """Check that the paginator reads the counter instead of COUNT."""
+        with self.assertNumQueries(2):
+            context = my_paginator(
+                Post.objects.all(),
+                1,
+                counter=POSTS,
+            )
+            self.assertEqual(context['page'].paginator.count, 3)
+            self.assertEqual(len(context['page']), 3)
+
+    def test_rebuild_counters_command(self):
+        """Check that the command restores drifted counters."""
+        Counter.objects.update(value=100)
+        call_command('rebuild_counters', stdout=StringIO())
+        self.assert_counters()
+
+
+class AuthorStatsTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create(username='author')
+        cls.reader = User.objects.create(username='reader')
+        Post.objects.create(text='Тест', author=cls.author)
+
+    def assert_stats(self, user, posts, followers, following):
+        stats = author_stats(
+            User.objects.select_related('stats').get(pk=user.pk))
+        self.assertEqual(
+            (stats.posts, stats.followers, stats.following),
+            (posts, followers, following)
+        )
+
+    def test_stats_follow_writes(self):
+        """Check stats after post and subscription writes."""
+        self.assert_stats(self.author, 1, 0, 0)
+        self.assert_stats(self.reader, 0, 0, 0)
+        Follow.objects.create(user=self.reader, author=self.author)
+        post = Post.objects.create(text='Тест', author=self.author)
+        self.assert_stats(self.author, 2, 1, 0)
+        self.assert_stats(self.reader, 0, 0, 1)
+        post.delete()
+        Follow.objects.all().delete()
+        self.assert_stats(self.author, 1, 0, 0)
+        self.assert_stats(self.reader, 0, 0, 0)
+
+    def test_author_card_renders_without_queries(self):
+        """Check that the card of the loaded author runs no queries."""
+        author_stats(self.author)
+        author = User.objects.select_related('stats').get(pk=self.author.pk)
+        with self.assertNumQueries(0):
+            html = render_to_string(
+                'includes/author_card.html',
+                {'author': author, 'stats': author_stats(author)},
+            )
+        self.assertIn('Записей: 1', html)
+
+    def test_reconcile_author_stats_command(self):
+        """Check that the command fixes the drifted stats."""
+        author_stats(self.author)
+        AuthorStats.objects.update(posts=10, followers=5)
+        out = StringIO()
+        call_command('reconcile_author_stats', '--dry-run', stdout=out)
+        self.assertIn('Drifted stats: 1', out.getvalue())
+        self.assertEqual(AuthorStats.objects.get().posts, 10)
+        call_command('reconcile_author_stats', stdout=out)
+        self.assert_stats(self.author, 1, 0, 0)
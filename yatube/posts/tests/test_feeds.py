@@ -0,0 +1,143 @@
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+
+from .. import feeds
+from ..counters import counted_queryset, counter_name, get_count
+from ..feeds import fan_out, follow_feed, rebuild
+from ..models import FeedItem, Follow, Post, User
+
+
+class FeedsTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create(username='author')
+        cls.readers = [
+            User.objects.create(username=f'reader_{number}')
+            for number in range(3)
+        ]
+        cls.old_post = Post.objects.create(text='Старый', author=cls.author)
+
+    def assert_timeline(self, user, posts):
+        self.assertEqual(list(follow_feed(user)), posts)
+        name = counter_name('feed', user.pk)
+        self.assertEqual(get_count(name), counted_queryset(name).count())
+        self.assertEqual(get_count(name), len(posts))
+
+    def test_follow_backfills_and_unfollow_prunes(self):
+        """Check timeline after following and unfollowing the author."""
+        reader = self.readers[0]
+        self.assert_timeline(reader, [])
+        Follow.objects.create(user=reader, author=self.author)
+        self.assert_timeline(reader, [self.old_post])
+        Follow.objects.filter(user=reader, author=self.author).delete()
+        self.assert_timeline(reader, [])
+
+    def test_new_post_fans_out_to_followers(self):
+        """Check that new and deleted posts reach every follower."""
+        for reader in self.readers:
+            Follow.objects.create(user=reader, author=self.author)
+        post = Post.objects.create(text='Новый', author=self.author)
+        for reader in self.readers:
+            with self.subTest(reader=reader):
+                self.assert_timeline(reader, [post, self.old_post])
+        post.delete()
+        for reader in self.readers:
+            with self.subTest(reader=reader):
+                self.assert_timeline(reader, [self.old_post])
+
+    def test_fan_out_by_batches(self):
+        """Check that fan-out with small batches reaches every follower."""
+        Follow.objects.bulk_create(
+            Follow(user=reader, author=self.author) for reader in self.readers
+        )
+        # На каждый пакет: SAVEPOINT, SELECT до и после INSERT, INSERT,
+        # UPDATE счётчиков, RELEASE.
+        with self.assertNumQueries(1 + 6 * len(self.readers)):
+            fan_out(self.old_post, batch_size=1)
+        self.assertEqual(
+            FeedItem.objects.filter(post=self.old_post).count(),
+            len(self.readers)
+        )
+
+    def test_repeated_delivery_is_counted_once(self):
+        """Check that posts already in the timeline are not counted."""
+        reader = self.readers[0]
+        Follow.objects.create(user=reader, author=self.author)
+        self.assert_timeline(reader, [self.old_post])
+        # Рассылка и заполнение ленты при подписке могут пересечься.
+        fan_out(self.old_post)
+        feeds.backfill(reader.pk, self.author.pk)
+        self.assert_timeline(reader, [self.old_post])
+
+    def test_rebuild_timelines(self):
+        """Check that rebuild restores lost timelines."""
+        Follow.objects.create(user=self.readers[0], author=self.author)
+        FeedItem.objects.all().delete()
+        self.assertEqual(rebuild(), 1)
+        self.assert_timeline(self.readers[0], [self.old_post])
+
+    def test_rebuild_inserts_latest_posts_at_once(self):
+        """Check that rebuild fills all timelines by one insert."""
+        post = Post.objects.create(text='Новый', author=self.author)
+        for reader in self.readers:
+            Follow.objects.create(user=reader, author=self.author)
+        FeedItem.objects.all().delete()
+        # Точка сохранения, две очистки, вставка лент, подсчёт записей и
+        # вставка счётчиков не зависят от числа подписок.
+        with self.assertNumQueries(7):
+            self.assertEqual(rebuild(limit=1), len(self.readers))
+        for reader in self.readers:
+            with self.subTest(reader=reader):
+                self.assert_timeline(reader, [post])
+
+
+@override_settings(FOLLOW_FEED_ENGINE='merge', FEED_AUTHOR_CACHE_SIZE=3)
+class MergedFeedTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.reader = User.objects.create(username='reader')
+        authors = [
+            User.objects.create(username=f'author_{number}')
+            for number in range(3)
+        ]
+        for author in authors:
+            Follow.objects.create(user=cls.reader, author=author)
+        Post.objects.create(text='Чужой', author=cls.reader)
+        # Авторы пишут по очереди, у последнего постов больше всего.
+        for number in range(8):
+            for author in authors[number % 3:]:
+                Post.objects.create(text=f'Пост {number}', author=author)
+        cls.expected = list(feeds.joined_feed(cls.reader))
+
+    def setUp(self):
+        cache.clear()
+
+    def test_merged_feed_matches_join(self):
+        """Check every slice of the merged feed against the join."""
+        feed = follow_feed(self.reader)
+        self.assertIsInstance(feed, feeds.MergedFeed)
+        self.assertEqual(len(feed), len(self.expected))
+        for start in range(0, len(self.expected), 4):
+            with self.subTest(start=start):
+                self.assertEqual(
+                    feed[start:start + 4],
+                    self.expected[start:start + 4]
+                )
+
+    def test_merged_feed_uses_cache(self):
+        """Check that the cached page needs no post-id queries."""
+        follow_feed(self.reader)[0:2]
+        # Подписки и сами посты: списки авторов берутся из кэша.
+        with self.assertNumQueries(2):
+            follow_feed(self.reader)[0:2]
+
+    def test_new_post_invalidates_author_list(self):
+        """Check that a new post appears in the merged feed at once."""
+        follow_feed(self.reader)[0:2]
+        post = Post.objects.create(
+            text='Новый',
+            author=self.expected[-1].author,
+        )
+        self.assertEqual(follow_feed(self.reader)[0:1], [post])
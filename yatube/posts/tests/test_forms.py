@@ -1,10 +1,26 @@
+import resource
+import sys
+from io import BytesIO, StringIO
+from multiprocessing import get_context
+from pathlib import Path
 from tempfile import mkdtemp
+from unittest import skipUnless
+from unittest.mock import patch
 
 from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
 from django.test import Client, override_settings
 from django.urls import reverse
+from PIL import Image
+from sorl.thumbnail.models import KVStore
 
+from ..images import ingest
 from ..models import Comment, Group, Post, User
+from ..storage import is_addressed
+from ..thumbnails import FORMATS, SIZES, WIDTHS
 from .basetestcase import BaseTestCase
 
 
@@ -273,3 +289,273 @@ class CommentsTestCase(BaseTestCase):
             f'{cls.url_login}?next={cls.url_add_comment}'
         )
         self.assertEqual(count, Comment.objects.count())
+
+
+@override_settings(MEDIA_ROOT=mkdtemp(dir=settings.BASE_DIR))
+class ThumbnailsTestCase(BaseTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create(username=f'user_{cls.__name__}')
+
+    def setUp(self):
+        self.authorized_client = Client()
+        self.authorized_client.force_login(self.__class__.user)
+
+    def new_post(self):
+        cls = self.__class__
+        self.authorized_client.post(cls.url_new_post, data={
+            'text': f'Картинка {cls.__name__}',
+            'image': cls.img_upload(),
+        })
+        post = Post.objects.get(text=f'Картинка {cls.__name__}')
+        return post, reverse('post', kwargs={
+            'username': cls.user.username, 'post_id': post.pk})
+
+    @override_settings(THUMBNAIL_ASYNC=True)
+    def test_worker_makes_thumbnails(self):
+        """Check the placeholder until the worker makes the thumbnails."""
+        post, url = self.new_post()
+        self.assertFalse(post.thumbnails_ready)
+        response = self.client.get(url)
+        self.assertContains(response, 'Изображение обрабатывается')
+        self.assertNotContains(response, '<img class="card-img"')
+        out = StringIO()
+        call_command('warm_thumbnails', stdout=out)
+        self.assertIn('Warmed posts: 1', out.getvalue())
+        post.refresh_from_db()
+        self.assertTrue(post.thumbnails_ready)
+        response = self.client.get(url)
+        self.assertContains(response, '<img class="card-img"')
+
+    @override_settings(THUMBNAIL_ASYNC=False)
+    def test_thumbnails_without_worker(self):
+        """Check that the thumbnails are made in the request."""
+        post, url = self.new_post()
+        self.assertTrue(post.thumbnails_ready)
+        self.assertContains(self.client.get(url), '<img class="card-img"')
+
+    @override_settings(THUMBNAIL_ASYNC=False)
+    def test_image_variants(self):
+        """Check the card offers every stored width and format."""
+        post, url = self.new_post()
+        self.assertEqual(set(post.image_variants), {'webp', 'jpeg'})
+        for image_format, variants in post.image_variants.items():
+            with self.subTest(image_format=image_format):
+                self.assertEqual(
+                    [width for _, width, _ in variants], list(WIDTHS))
+                for name, _, _ in variants:
+                    self.assertTrue(name.endswith(
+                        '.jpg' if image_format == 'jpeg' else '.webp'))
+        response = self.client.get(url)
+        self.assertContains(response, '<source type="image/webp"')
+        self.assertContains(response, ' 1440w"')
+        self.assertContains(response, f'sizes="{SIZES}"')
+
+    @override_settings(THUMBNAIL_ASYNC=True)
+    def test_image_without_variants(self):
+        """Check the old image without variants is shown by one thumbnail."""
+        post, url = self.new_post()
+        # Так выглядят посты, загруженные до появления вариантов.
+        Post.objects.filter(pk=post.pk).update(thumbnails_ready=True)
+        response = self.client.get(url)
+        self.assertNotContains(response, 'Изображение обрабатывается')
+        self.assertNotContains(response, '<source')
+        self.assertContains(response, '<img class="card-img"')
+
+    @override_settings(THUMBNAIL_ASYNC=True)
+    def test_regenerate_thumbnails(self):
+        """Check the pool makes the thumbnails and fills the sorl store."""
+        post, url = self.new_post()
+        out = StringIO()
+        call_command('regenerate_thumbnails', workers=2, stdout=out)
+        self.assertIn('Regenerated posts: 1', out.getvalue())
+        post.refresh_from_db()
+        self.assertTrue(post.thumbnails_ready)
+        # Исходник, миниатюры и список миниатюр исходника.
+        self.assertEqual(
+            KVStore.objects.count(), len(WIDTHS) * len(FORMATS) + 2)
+        response = self.client.get(url)
+        self.assertContains(response, '<img class="card-img"')
+        out = StringIO()
+        call_command('regenerate_thumbnails', workers=1, after=post.pk,
+                     stdout=out)
+        self.assertIn('Regenerated posts: 0', out.getvalue())
+
+    @override_settings(THUMBNAIL_ASYNC=True)
+    def test_regenerate_skips_broken_images(self):
+        """Check the broken and missing images do not stop the pool."""
+        post, _ = self.new_post()
+        cls = self.__class__
+        broken = Post.objects.create(
+            text='Битая', author=cls.user, image='posts/broken.jpg')
+        Path(settings.MEDIA_ROOT, 'posts', 'broken.jpg').write_bytes(b'x')
+        missing = Post.objects.create(
+            text='Пропавшая', author=cls.user, image='posts/missing.jpg')
+        out, err = StringIO(), StringIO()
+        # sorl пишет в журнал трассировку каждой нечитаемой картинки.
+        with patch('sorl.thumbnail.base.logger'):
+            call_command('regenerate_thumbnails', workers=2, force=True,
+                         stdout=out, stderr=err)
+        post.refresh_from_db()
+        self.assertTrue(post.thumbnails_ready)
+        thumbnail = Path(
+            settings.MEDIA_ROOT, post.image_variants['jpeg'][0][0])
+        made = thumbnail.stat().st_mtime_ns
+        with patch('sorl.thumbnail.base.logger'):
+            call_command('regenerate_thumbnails', workers=1, force=True,
+                         stdout=StringIO(), stderr=StringIO())
+        # С --force файлы миниатюр делаются заново под теми же именами.
+        self.assertGreater(thumbnail.stat().st_mtime_ns, made)
+        for failed in (broken, missing):
+            with self.subTest(post=failed.text):
+                failed.refresh_from_db()
+                self.assertFalse(failed.thumbnails_ready)
+                self.assertIn(f'{failed.pk}: ', err.getvalue())
+        self.assertIn('Failed posts: 2', out.getvalue())
+
+
+def jpeg(size, seed=None, **params):
+    content = BytesIO()
+    if seed is None:
+        image = Image.effect_noise(size, 30).convert('RGB')
+    else:
+        image = Image.new('RGB', size, (seed, 128, 255 - seed))
+    image.save(content, 'JPEG', **params)
+    return content.getvalue()
+
+
+def ingest_peak(content):
+    """Return the growth of the peak memory of the process on the ingest."""
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    ingest(SimpleUploadedFile('photo.jpg', content))
+    # ru_maxrss is in kilobytes on Linux.
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - before) * 1024
+
+
+@override_settings(MEDIA_ROOT=mkdtemp(dir=settings.BASE_DIR))
+class ImageIngestionTestCase(BaseTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.temp_media_dir = settings.MEDIA_ROOT
+        cls.user = User.objects.create(username=f'user_{cls.__name__}')
+
+    def setUp(self):
+        self.authorized_client = Client()
+        self.authorized_client.force_login(self.__class__.user)
+
+    def upload(self, content, name='photo.jpg'):
+        return self.authorized_client.post(self.__class__.url_new_post, data={
+            'text': f'Фото {self.__class__.__name__}',
+            'image': SimpleUploadedFile(name, content),
+        })
+
+    @override_settings(IMAGE_MAX_SIZE=100)
+    def test_upload_is_reduced_without_exif(self):
+        """Check the stored image is reduced, stripped and measured."""
+        exif = Image.Exif()
+        exif[0x010F] = 'Camera'
+        self.upload(jpeg((400, 200), exif=exif.tobytes()))
+        post = Post.objects.get(text=f'Фото {self.__class__.__name__}')
+        self.assertEqual((post.image_width, post.image_height), (100, 50))
+        self.assertEqual(post.image_bytes, post.image.size)
+        with Image.open(post.image) as image:
+            self.assertEqual(image.size, (100, 50))
+            self.assertFalse(image.getexif())
+
+    @override_settings(IMAGE_MAX_PIXELS=100)
+    def test_too_large_upload_is_rejected(self):
+        """Check the image over the pixel limit is not stored."""
+        response = self.upload(jpeg((50, 50)))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('image', response.context['form'].errors)
+        self.assertFalse(Post.objects.exists())
+
+    @skipUnless(sys.platform.startswith('linux'), 'ru_maxrss in kilobytes')
+    @override_settings(IMAGE_MAX_SIZE=1000)
+    def test_ingest_memory_is_bounded(self):
+        """Check the big photo is never decoded in full."""
+        width, height = 6000, 4000
+        content = jpeg((width, height), quality=50)
+        # The fresh process, its peak is not raised by the other tests;
+        # the full decode would take width * height * 3 bytes.
+        with get_context('fork').Pool(1) as pool:
+            peak = pool.apply(ingest_peak, (content,))
+        self.assertLess(peak, width * height * 3 // 4)
+
+
+@override_settings(MEDIA_ROOT=mkdtemp(dir=settings.BASE_DIR))
+class ImageStorageTestCase(BaseTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.temp_media_dir = settings.MEDIA_ROOT
+        cls.users = [
+            User.objects.create(username=f'user_{cls.__name__}_{number}')
+            for number in range(2)
+        ]
+
+    def upload(self, user):
+        client = Client()
+        client.force_login(user)
+        client.post(self.__class__.url_new_post, data={
+            'text': f'Мем {user.username}',
+            'image': SimpleUploadedFile('meme.jpg', jpeg((64, 64), seed=1)),
+        })
+        return Post.objects.get(author=user)
+
+    def test_same_image_is_stored_once(self):
+        """Check the posts share the file until the last one is deleted."""
+        first, second = (self.upload(user) for user in self.__class__.users)
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertTrue(is_addressed(first.image.name))
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertTrue(default_storage.exists(second.image.name))
+        with self.captureOnCommitCallbacks(execute=True):
+            second.delete()
+        self.assertFalse(default_storage.exists(second.image.name))
+
+    def test_dedupe_images(self):
+        """Check the stored copies of the image are merged into one."""
+        legacy = FileSystemStorage()
+        content = jpeg((64, 64), seed=1)
+        posts = [
+            Post.objects.create(
+                text=f'Старый мем {number}',
+                author=user,
+                image=legacy.save(f'posts/meme_{number}.jpg',
+                                  ContentFile(content)),
+            )
+            for number, user in enumerate(self.__class__.users)
+        ]
+        out = StringIO()
+        call_command('dedupe_images', stdout=out)
+        self.assertIn('Renamed images: 2, duplicates: 1', out.getvalue())
+        for post in posts:
+            old_name = post.image.name
+            post.refresh_from_db()
+            with self.subTest(post=post.text):
+                self.assertTrue(is_addressed(post.image.name))
+                self.assertTrue(post.thumbnails_ready)
+                self.assertFalse(legacy.exists(old_name))
+        self.assertEqual(posts[0].image.name, posts[1].image.name)
+        self.assertTrue(default_storage.exists(posts[0].image.name))
+
+    def test_dedupe_images_deletes_orphans(self):
+        """Check the files no post refers to are deleted."""
+        post = self.upload(self.__class__.users[0])
+        orphan = default_storage.save(
+            'posts/lost.jpg', ContentFile(jpeg((64, 64), seed=2)))
+        call_command('dedupe_images', '--dry-run', stdout=StringIO())
+        self.assertTrue(default_storage.exists(orphan))
+        call_command('dedupe_images', stdout=StringIO())
+        self.assertFalse(default_storage.exists(orphan))
+        self.assertTrue(default_storage.exists(post.image.name))
+        out = StringIO()
+        call_command('dedupe_images', stdout=out)
+        self.assertIn('Orphaned images: 0', out.getvalue())
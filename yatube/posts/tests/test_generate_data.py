@@ -0,0 +1,90 @@
+from io import StringIO
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db.models import Count, F
+from django.test import TestCase, override_settings
+
+from ..counters import POSTS, get_count
+from ..feeds import follow_feed
+from ..models import Comment, Counter, FeedItem, Follow, Group, Post, User
+
+
+class GenerateDataTestCase(TestCase):
+
+    def generate(self, **options):
+        out = StringIO()
+        options = {
+            'users': 50,
+            'groups': 3,
+            'posts': 500,
+            'comments': 1000,
+            'follows': 400,
+            'seed': 1,
+            'batch_size': 64,
+            **options,
+        }
+        call_command('generate_data', stdout=out, **options)
+        return out.getvalue()
+
+    def test_generated_data(self):
+        """Check the rows are consistent and the viral posts stand out."""
+        out = self.generate(viral_posts=2, viral_share=0.5)
+        self.assertEqual(User.objects.count(), 50)
+        self.assertEqual(Group.objects.count(), 3)
+        self.assertEqual(Post.objects.count(), 500)
+        self.assertEqual(Comment.objects.count(), 1000)
+        self.assertFalse(Follow.objects.filter(user=F('author')).exists())
+        # Даты распределены по времени, а не равны времени вставки.
+        self.assertGreater(
+            Post.objects.order_by().values('pub_date').distinct().count(),
+            490)
+        self.assertFalse(Comment.objects.filter(
+            created__lt=F('post__pub_date')).exists())
+        # Счётчики комментариев и постов пересчитаны.
+        self.assertFalse(Post.objects.annotate(
+            total=Count('comments')).exclude(
+            comment_count=F('total')).exists())
+        self.assertEqual(get_count(POSTS), 500)
+        viral = out.split('viral posts: ')[1].splitlines()[0].split(', ')
+        top = Post.objects.order_by('-comment_count')[:2]
+        self.assertEqual(
+            {str(post.pk) for post in top}, set(viral))
+        self.assertGreater(top[1].comment_count, 100)
+
+    @override_settings(FOLLOW_FEED_ENGINE='timeline')
+    def test_timelines_are_filled(self):
+        """Check every follower gets the latest posts of the author."""
+        out = self.generate()
+        self.assertIn(f'timelines: {FeedItem.objects.count()}', out)
+        follow = Follow.objects.filter(author__posts__isnull=False).first()
+        latest = Post.objects.filter(author_id=follow.author_id)[
+            :settings.FEED_BACKFILL_COUNT]
+        self.assertEqual(
+            list(follow_feed(follow.user).filter(author_id=follow.author_id)),
+            list(latest),
+        )
+        self.assertFalse(Counter.objects.filter(
+            name__startswith='feed:', value__lte=0).exists())
+
+    @override_settings(FOLLOW_FEED_ENGINE='timeline')
+    def test_timelines_are_not_skipped_for_timeline_engine(self):
+        """Check the timeline engine refuses to run without timelines."""
+        with self.assertRaises(CommandError):
+            self.generate(skip_timelines=True)
+        self.assertFalse(User.objects.exists())
+
+    def test_power_law_of_followers(self):
+        """Check a tenth of the authors get most of the followers."""
+        self.generate(users=500, posts=0, comments=0, follows=2000)
+        followers = sorted(Follow.objects.order_by().values(
+            'author').annotate(total=Count('pk')).values_list(
+            'total', flat=True), reverse=True)
+        self.assertGreater(sum(followers[:50]), sum(followers) / 2)
+
+    def test_prefix_is_not_reused(self):
+        """Check the second run with the same prefix is refused."""
+        self.generate(users=2, posts=0, comments=0, follows=0)
+        with self.assertRaises(CommandError):
+            self.generate(users=2, posts=0, comments=0, follows=0)
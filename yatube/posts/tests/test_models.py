@@ -32,3 +32,18 @@ class ModelTestCase(TestCase):
         for string_presentation, model in models_string_presentations:
             with self.subTest(exept_str=string_presentation, model=model):
                 self.assertEqual(string_presentation, str(model))
+
+    def test_post_comment_count(self):
+        """Check that comment_count follows creation and deletion."""
+        cls = self.__class__
+        user = User.objects.create(username=f'user_{cls.__name__}')
+        post = Post.objects.create(text=f'Тест_{cls.__name__}', author=user)
+        comments = [
+            Comment.objects.create(post=post, author=user, text='Тест')
+            for _ in range(3)
+        ]
+        post.refresh_from_db()
+        self.assertEqual(post.comment_count, 3)
+        comments[0].delete()
+        post.refresh_from_db()
+        self.assertEqual(post.comment_count, 2)
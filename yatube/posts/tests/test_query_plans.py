@@ -0,0 +1,25 @@
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+
+from ..management.commands.audit_query_plans import plan_problems
+from ..models import Post
+
+
+class QueryPlansTestCase(TestCase):
+
+    def test_hot_queries_use_indexes(self):
+        """Check that the views run no full scans and temp sorts."""
+        for engine in ('timeline', 'merge'):
+            out = StringIO()
+            with self.subTest(engine=engine):
+                with override_settings(FOLLOW_FEED_ENGINE=engine):
+                    call_command('audit_query_plans', stdout=out)
+                self.assertNotIn('FAIL', out.getvalue())
+
+    def test_bad_plan_is_reported(self):
+        """Check that the audit notices a scan and a temp sort."""
+        self.assertTrue(plan_problems(Post.objects.order_by('text')))
+        self.assertTrue(plan_problems(
+            Post.objects.filter(text='Тест').order_by()))
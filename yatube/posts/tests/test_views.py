@@ -1,12 +1,28 @@
-from tempfile import mkdtemp
+from http import HTTPStatus
+from io import StringIO
+from pathlib import Path
+from tempfile import TemporaryDirectory, mkdtemp
+from threading import Barrier, Thread
+from time import monotonic, sleep, time
+from unittest.mock import patch
 
 from django.conf import settings
 from django.core.cache import cache
-from django.test import Client, override_settings
+from django.core.management import call_command
+from django.db import connection, connections
+from django.test import Client, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 
+from ..cache import flush_stats, local, page_stats, record, single_flight
+from ..feeds import index_feed
 from ..forms import PostForm
-from ..models import Follow, Group, Post, User
+from ..middleware import PRIMARY_COOKIE
+from ..models import Comment, Counter, Follow, Group, Post, User
+from ..paginator import CursorPaginator, page_links
+from ..routers import finish_request, start_request
+from ..search import SearchResults, install
+from ..thumbnails import release
 from ..views import my_paginator
 from .basetestcase import BaseTestCase
 
@@ -87,6 +103,8 @@ class PostsTestsCase(BaseTestCase):
             cls.url_index,
             cls.url_group,
         )
+        # Кеш главной страницы общий для гостей и пользователей.
+        cache.clear()
         for url in in_list_url:
             response = self.authorized_client.get(url)
             with self.subTest(url=url):
@@ -167,6 +185,17 @@ class PostsContextTestsCase(BaseTestCase):
         author = response.context['author']
         self.assertEqual(cls.user, author)
         self.assertEqual(cls.user.username, author.username)
+        # В кеш попадают только поля профиля, без пароля и почты.
+        entry = cache.get(f'object:author:{cls.user.username}')
+        self.assertEqual(
+            entry['content']['user'],
+            {
+                'id': cls.user.pk,
+                'username': cls.user.username,
+                'first_name': cls.user.first_name,
+                'last_name': cls.user.last_name,
+            },
+        )
 
     def test_group_shows_correct_context(self):
         """Check group view context."""
@@ -352,10 +381,291 @@ class PaginatorViewsTestCase(BaseTestCase):
                 self.assertIn('page', response.context)
                 self.assertIn('from_page', response.context)
                 self.assertIn('to_page', response.context)
+                self.assertIn('page_links', response.context)
+
+    def test_page_links(self):
+        """Check the list of page numbers to draw."""
+        check_links = (
+            # (номер страницы, всего страниц, окно, ожидаемые ссылки)
+            (1, 2, (2, 1), [1, 2]),
+            (1, 6, (2, 2), [1, 2, None, 6]),
+            (3, 6, (2, 4), [1, 2, 3, 4, None, 6]),
+            (6, 6, (5, 5), [1, None, 5, 6]),
+            (50000, 100000, (49999, 50001),
+             [1, None, 49999, 50000, 50001, None, 100000]),
+        )
+        for number, num_pages, (from_page, to_page), links in check_links:
+            with self.subTest(number=number, num_pages=num_pages):
+                self.assertEqual(
+                    page_links(number, num_pages, from_page, to_page), links)
+
+
+@override_settings(CURSOR_PAGINATION=True)
+class CursorPaginatorTestCase(BaseTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create(username=f'user_{cls.__name__}')
+        Post.objects.bulk_create(
+            Post(text=f'Тест {count}', author=cls.user)
+            for count in range(settings.MAX_PAGE_COUNT * 3 + 3)
+        )
+        # bulk_create ставит всем постам одно и то же время публикации,
+        # порядок определяется только вторичным ключом pk.
+        cls.expected = list(Post.objects.order_by('-pub_date', '-pk'))
+
+    def get_page(self, **cursor):
+        return my_paginator(Post.objects.all(), None, **cursor)['page']
+
+    def test_cursor_walks_forward_and_back(self):
+        """Check that the tokens visit every post exactly once."""
+        page = self.get_page()
+        self.assertFalse(page.has_previous())
+        forward = [list(page)]
+        while page.has_next():
+            page = self.get_page(after=page.next_cursor)
+            forward.append(list(page))
+        self.assertEqual(sum(forward, []), self.expected)
+        self.assertEqual(len(forward[-1]), 3)
+        backward = [list(page)]
+        while page.has_previous():
+            page = self.get_page(before=page.previous_cursor)
+            backward.insert(0, list(page))
+        self.assertEqual(backward, forward)
+
+    def test_cursor_page_costs_one_query(self):
+        """Check that a deep page is fetched without COUNT and OFFSET."""
+        deep = self.expected[-5]
+        paginator = CursorPaginator(Post.objects.all(), 2)
+        paginator.after = (deep.pub_date, deep.pk)
+        with self.assertNumQueries(1):
+            page = paginator.get_page()
+            self.assertEqual(list(page), self.expected[-4:-2])
+
+    def test_broken_cursor_returns_first_page(self):
+        """Check that a malformed token falls back to the first page."""
+        page = self.get_page(after='%%%')
+        self.assertEqual(list(page), self.expected[:settings.MAX_PAGE_COUNT])
+        self.assertFalse(page.has_previous())
+
+    def test_cursor_links_in_template(self):
+        """Check that the paginator template renders token links."""
+        cache.clear()
+        response = self.client.get(self.url_index)
+        next_cursor = response.context['page'].next_cursor
+        self.assertContains(response, f'?after={next_cursor}')
+        self.assertNotContains(response, '?page=')
+
+
+class SearchTestCase(BaseTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create(username=f'user_{cls.__name__}')
+        cls.url_search = reverse('search')
+        # Индекс пополняют триггеры, bulk_create тоже.
+        Post.objects.bulk_create(
+            Post(text=f'Заметка про котов номер {count}', author=cls.user)
+            for count in range(settings.MAX_PAGE_COUNT + 3)
+        )
+        cls.best = Post.objects.create(
+            text='Коты, коты и ещё раз КОТЫ', author=cls.user)
+
+    def search(self, query):
+        return [post.pk for post in SearchResults(query)[0:100]]
+
+    def test_search_ranks_matches(self):
+        """Check all words are found, the last by prefix, the best first."""
+        self.assertEqual(self.search('коты')[0], self.best.pk)
+        self.assertEqual(len(self.search('коты')), 1)
+        self.assertEqual(len(self.search('котов номер')), 13)
+        self.assertEqual(len(self.search('заметка ко')), 13)
+        self.assertEqual(self.search('собаки'), [])
+        # Синтаксис FTS5 ищется как обычные слова.
+        self.assertEqual(self.search('"коты" (^'), [self.best.pk])
+        self.assertEqual(self.search('***'), [])
+
+    @override_settings(SEARCH_MAX_RESULTS=3)
+    def test_search_ranks_newest_matches(self):
+        """Check only the newest matches of the cap are ranked."""
+        newest = Post.objects.filter(text__startswith='Заметка').order_by(
+            '-pk').values_list('pk', flat=True)[:3]
+        self.assertCountEqual(self.search('котов'), newest)
+        self.assertEqual(self.search('кот')[0], self.best.pk)
+
+    def test_index_follows_changes(self):
+        """Check the updated and deleted posts are searched by the text."""
+        post = Post.objects.create(text='Про собак', author=self.user)
+        self.assertEqual(self.search('собак'), [post.pk])
+        Post.objects.filter(pk=post.pk).update(text='Про ежей')
+        self.assertEqual(self.search('собак'), [])
+        self.assertEqual(self.search('ежей'), [post.pk])
+        post.delete()
+        self.assertEqual(self.search('ежей'), [])
+
+    def test_dropped_triggers_are_installed(self):
+        """Check the triggers dropped by a migration are created again."""
+        self.assertFalse(install(connection))
+        with connection.cursor() as cursor:
+            cursor.execute('DROP TRIGGER posts_post_search_update')
+        Post.objects.filter(pk=self.best.pk).update(text='Про ежей')
+        self.assertTrue(install(connection))
+        self.assertEqual(self.search('ежей'), [self.best.pk])
+        self.assertEqual(self.search('коты'), [])
+
+    @override_settings(SEARCH_MAX_RESULTS=12)
+    def test_search_page(self):
+        """Check the results are paged with the query and capped."""
+        response = self.client.get(self.url_search, {'q': 'котов'})
+        page = response.context['page']
+        self.assertEqual(page.paginator.count, 12)
+        self.assertEqual(len(page), settings.MAX_PAGE_COUNT)
+        self.assertContains(
+            response, '?q=%D0%BA%D0%BE%D1%82%D0%BE%D0%B2&amp;page=2')
+        response = self.client.get(self.url_search, {'q': 'котов', 'page': 2})
+        self.assertEqual(len(response.context['page']), 2)
+        response = self.client.get(self.url_search)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(len(response.context['page']), 0)
+
+    def test_admin_search_uses_index(self):
+        """Check the admin searches the posts by the index, not LIKE."""
+        admin = User.objects.create_superuser('admin', password='admin')
+        self.client.force_login(admin)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(
+                reverse('admin:posts_post_changelist'), {'q': 'коты'})
+        self.assertEqual(
+            list(response.context['cl'].result_list), [self.best])
+        sql = ' '.join(query['sql'] for query in queries.captured_queries)
+        self.assertIn('MATCH', sql)
+        self.assertNotIn('LIKE', sql)
+
+
+class LargeTableAdminTestCase(BaseTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.admin = User.objects.create_superuser('admin', password='admin')
+        cls.group = Group.objects.create(title='Группа', slug='admin_group')
+        cls.authors = User.objects.bulk_create(
+            User(username=f'author_{number}') for number in range(5))
+        for author in cls.authors:
+            Post.objects.bulk_create(
+                Post(text='Очень длинный текст ' * 20, author=author,
+                     group=cls.group)
+                for _ in range(3)
+            )
+        cls.post = Post.objects.latest('pk')
+        Comment.objects.bulk_create(
+            Comment(text='Комментарий', author=author, post=cls.post)
+            for author in cls.authors
+        )
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def get(self, name, **params):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(
+                reverse(f'admin:posts_{name}_changelist'), params)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        return response, [query['sql'] for query in queries]
+
+    def test_change_lists_take_few_queries(self):
+        """Check the rows are joined and all users are not listed."""
+        for name in ('post', 'comment', 'follow'):
+            with self.subTest(name=name):
+                _, queries = self.get(name)
+                # Сессия, пользователь, счёт и строки с их связями.
+                self.assertEqual(len(queries), 4 + 2)
+                self.assertFalse([
+                    sql for sql in queries
+                    if 'FROM "auth_user"' in sql and 'LIMIT' not in sql
+                ])
+
+    @override_settings(ADMIN_COUNT_LIMIT=10, ADMIN_TEXT_LENGTH=30)
+    def test_change_list_counts_up_to_limit(self):
+        """Check the rows are counted up to the limit, the text cut."""
+        response, queries = self.get('post')
+        changelist = response.context['cl']
+        self.assertEqual(changelist.result_count, 10)
+        self.assertIsNone(changelist.full_result_count)
+        self.assertContains(response, 'Больше 10')
+        self.assertContains(response, 'Очень длинный текст Очень дли…')
+        counts = [sql for sql in queries if 'COUNT(*)' in sql]
+        self.assertEqual(len(counts), 1)
+        self.assertIn('LIMIT 11', counts[0])
+
+    def test_autocomplete_filters(self):
+        """Check the author and group filters are autocomplete selects."""
+        author = self.authors[0]
+        response, _ = self.get(
+            'post',
+            author__id__exact=author.pk,
+            group__id__exact=self.group.pk,
+        )
+        self.assertEqual(
+            response.context['cl'].result_count, 3)
+        for name in ('author', 'group'):
+            self.assertContains(response, f'data-field-name="{name}"')
+        self.assertContains(
+            response, f'<option value="{author.pk}" selected>{author}')
+        self.assertNotContains(response, self.authors[1].username)
+        response = self.client.get(reverse('admin:autocomplete'), {
+            'app_label': 'posts', 'model_name': 'post',
+            'field_name': 'author', 'term': 'author_1',
+        })
+        self.assertEqual(
+            [result['text'] for result in response.json()['results']],
+            ['author_1'],
+        )
+
+
+class CommentCountViewsTestCase(BaseTestCase):
+
+    def test_feed_queries_do_not_depend_on_comments(self):
+        """Check that feeds do not load comments of the posts."""
+        cls = self.__class__
+        user = User.objects.create(username=f'user_{cls.__name__}')
+        post = Post.objects.create(text=f'Тест {cls.__name__}', author=user)
+        urls = (
+            cls.url_index,
+            reverse('profile', kwargs={'username': user.username}),
+        )
+        queries = {}
+        for url in urls:
+            cache.clear()
+            self.client.get(url)
+            cache.clear()
+            with CaptureQueriesContext(connection) as captured:
+                self.client.get(url)
+            queries[url] = len(captured)
+        for _ in range(20):
+            Comment.objects.create(post=post, author=user, text='Тест')
+        for url in urls:
+            cache.clear()
+            with self.subTest(url=url):
+                with self.assertNumQueries(queries[url]):
+                    response = self.client.get(url)
+                self.assertContains(response, 'Комментариев: 20')
 
 
 class CacheViewsTestCase(BaseTestCase):
 
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create(username=f'author_{cls.__name__}')
+        cls.group = Group.objects.create(
+            title=f'Группа {cls.__name__}',
+            slug=f'group_{cls.__name__}',
+        )
+        cls.url_group = reverse('group', kwargs={'slug': cls.group.slug})
+
     def test_index_page_cache(self):
         """Check caching of the index.html (url '/')."""
         cls = self.__class__
@@ -363,15 +673,419 @@ class CacheViewsTestCase(BaseTestCase):
         cache.clear()
         response = self.client.get(cls.url_index)
         content_start = response.content
+        Follow.objects.create(user=user, author=cls.user)
+        response = self.client.get(cls.url_index)
+        self.assertEqual(content_start, response.content)
         Post.objects.create(
             text=f'Тест {cls.__name__}',
             author=user,
         )
         response = self.client.get(cls.url_index)
-        self.assertEqual(content_start, response.content)
+        self.assertNotEqual(content_start, response.content)
+
+    def test_group_page_cache_versions(self):
+        """Check that only writes into the group refresh its page."""
+        cls = self.__class__
+        other = Group.objects.create(title='Другая', slug=f'{cls.__name__}')
+        cache.clear()
+        content_start = self.client.get(cls.url_group).content
+        Post.objects.create(text='Чужая группа', author=cls.user, group=other)
+        self.assertEqual(content_start, self.client.get(cls.url_group).content)
+        post = Post.objects.create(
+            text='Своя группа', author=cls.user, group=cls.group)
+        content = self.client.get(cls.url_group).content
+        self.assertNotEqual(content_start, content)
+        Comment.objects.create(post=post, author=cls.user, text='Тест')
+        self.assertNotEqual(content, self.client.get(cls.url_group).content)
+
+    def test_index_page_cache_is_shared(self):
+        """Check that guests and users share the cached index body."""
+        cls = self.__class__
+        user = User.objects.create(username=f'user_{cls.__name__}')
+        Post.objects.create(text=f'Тест {cls.__name__}', author=user)
+        client = Client()
+        client.force_login(user)
+        # Счётчики прошлых тестов из памяти процесса.
+        flush_stats()
         cache.clear()
+        self.client.get(cls.url_index)
+        with self.assertNumQueries(4):
+            # Точка сохранения, сессия и пользователь: лента из кеша.
+            response = client.get(cls.url_index)
+        self.assertContains(response, f'Пользователь: {user.username}')
+        self.assertContains(response, 'Редактировать')
+        self.assertNotContains(response, '<!--hole:')
+        self.assertEqual(response['Cache-Control'], 'private')
         response = self.client.get(cls.url_index)
-        self.assertNotEqual(content_start, response.content)
+        self.assertNotContains(response, 'Редактировать')
+        self.assertContains(response, 'Войти')
+        self.assertEqual(
+            page_stats('index_page'),
+            {'hits': 2, 'misses': 1, 'hit_rate': 2 / 3},
+        )
+
+    def test_page_stats_are_counted_in_memory(self):
+        """Check that the hits reach the shared cache once in a while."""
+        flush_stats()
+        cache.clear()
+        with patch.object(cache, 'add') as add:
+            for _ in range(5):
+                record('stats_page', True)
+        add.assert_not_called()
+        later = time() + settings.PAGE_STATS_FLUSH_INTERVAL
+        with patch('posts.cache.time', return_value=later):
+            record('stats_page', False)
+        self.assertEqual(
+            cache.get_many(['page_stats:stats_page:hits',
+                            'page_stats:stats_page:misses']),
+            {'page_stats:stats_page:hits': 5,
+             'page_stats:stats_page:misses': 1},
+        )
+
+    def test_post_cards_are_shared(self):
+        """Check that a card is rendered once for all pages and visitors."""
+        cls = self.__class__
+        post = Post.objects.create(
+            text='Общая карточка', author=cls.user, group=cls.group)
+        url_profile = reverse('profile', kwargs={'username': cls.user})
+        client = Client()
+        client.force_login(cls.user)
+        cache.clear()
+        self.client.get(cls.url_index)
+        with self.assertTemplateNotUsed(
+                template_name='includes/post_item.html'):
+            response = client.get(url_profile)
+        self.assertContains(response, 'Общая карточка')
+        # Кнопки владельца подставляются в карточку для каждого посетителя.
+        self.assertContains(response, 'Редактировать')
+        self.assertNotContains(response, '<!--hole:')
+        Comment.objects.create(post=post, author=cls.user, text='Тест')
+        response = client.get(url_profile)
+        self.assertTemplateUsed(response, 'includes/post_item.html')
+        self.assertContains(response, 'Комментариев: 1')
+
+
+class ConditionalGetTestCase(BaseTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create(username=f'author_{cls.__name__}')
+        cls.group = Group.objects.create(
+            title=f'Группа {cls.__name__}',
+            slug=f'group_{cls.__name__}',
+        )
+        cls.post = Post.objects.create(
+            text='Тест', author=cls.user, group=cls.group)
+        cls.urls = (
+            cls.url_index,
+            reverse('group', kwargs={'slug': cls.group.slug}),
+            reverse('profile', kwargs={'username': cls.user.username}),
+            reverse('post', kwargs={
+                'username': cls.user.username, 'post_id': cls.post.pk}),
+        )
+
+    def test_not_modified_pages(self):
+        """Check that unchanged pages are answered 304 without queries."""
+        cache.clear()
+        for url in self.urls:
+            response = self.client.get(url)
+            with self.subTest(url=url):
+                # Только точка сохранения ATOMIC_REQUESTS.
+                with self.assertNumQueries(2):
+                    response = self.client.get(
+                        url, HTTP_IF_NONE_MATCH=response['ETag'])
+                self.assertEqual(response.status_code, HTTPStatus.NOT_MODIFIED)
+
+    def test_modified_pages(self):
+        """Check that a comment changes the validators of all pages."""
+        cache.clear()
+        validators = {}
+        for url in self.urls:
+            response = self.client.get(url)
+            validators[url] = response['ETag'], response['Last-Modified']
+        # Last-Modified точен до секунды, комментарий пишем секундой позже.
+        with patch('posts.cache.time', return_value=time() + 1):
+            Comment.objects.create(
+                post=self.post, author=self.user, text='Тест')
+        for url, (etag, modified) in validators.items():
+            with self.subTest(url=url):
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, HTTPStatus.OK)
+                response = self.client.get(
+                    url, HTTP_IF_MODIFIED_SINCE=modified)
+                self.assertEqual(response.status_code, HTTPStatus.OK)
+
+    def test_validators_depend_on_visitor(self):
+        """Check that the visitor's ETag is not valid for another one."""
+        cache.clear()
+        etag = self.client.get(self.url_index)['ETag']
+        client = Client()
+        client.force_login(self.user)
+        response = client.get(self.url_index, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertFalse(response.has_header('Last-Modified'))
+        response = client.get(
+            self.url_index, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, HTTPStatus.NOT_MODIFIED)
+
+
+@override_settings(LOCAL_CACHE_SIZE=100)
+class LocalCacheTestCase(BaseTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create(username=f'author_{cls.__name__}')
+        cls.reader = User.objects.create(username=f'reader_{cls.__name__}')
+        cls.url_profile = reverse(
+            'profile', kwargs={'username': cls.user.username})
+
+    def setUp(self):
+        cache.clear()
+        local.clear()
+
+    def get_user_queries(self):
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.get(self.url_profile)
+        return response, [
+            query for query in captured if 'FROM "auth_user"' in query['sql']]
+
+    def test_author_is_read_from_local_cache(self):
+        """Check that the author is loaded once and reloaded on a write."""
+        _, queries = self.get_user_queries()
+        self.assertEqual(len(queries), 1)
+        _, queries = self.get_user_queries()
+        self.assertEqual(queries, [])
+        Follow.objects.create(user=self.reader, author=self.user)
+        response, queries = self.get_user_queries()
+        self.assertEqual(len(queries), 1)
+        self.assertContains(response, 'Подписчиков: 1')
+
+    def test_other_worker_write_is_seen_after_version_ttl(self):
+        """Check that versions bumped elsewhere are checked periodically."""
+        self.get_user_queries()
+        # Другой процесс меняет версию только в общем кеше.
+        cache.incr(f'version:author:{self.user.username}')
+        _, queries = self.get_user_queries()
+        self.assertEqual(queries, [])
+        later = monotonic() + settings.LOCAL_VERSION_TTL + 1
+        with patch('posts.local_cache.monotonic', return_value=later):
+            _, queries = self.get_user_queries()
+        self.assertEqual(len(queries), 1)
+
+
+class CacheStampedeTestCase(TransactionTestCase):
+
+    def test_one_request_rebuilds_expired_page(self):
+        """Check that concurrent requests run the feed queries once."""
+        user = User.objects.create(username='stampede')
+        Post.objects.create(text='Старый пост', author=user)
+        url = reverse('index')
+        cache.clear()
+        Client().get(url)
+        # Новый пост делает страницу устаревшей для всех потоков сразу.
+        Post.objects.create(text='Новый пост', author=user)
+        feed_queries = []
+        start = Barrier(8)
+
+        def slow_feed():
+            sleep(0.3)
+            return index_feed()
+
+        def count_feed_queries(execute, sql, params, many, context):
+            if 'FROM "posts_post"' in sql:
+                feed_queries.append(sql)
+            return execute(sql, params, many, context)
+
+        def visit(contents):
+            try:
+                with connection.execute_wrapper(count_feed_queries):
+                    start.wait()
+                    contents.append(Client().get(url).content)
+            finally:
+                connection.close()
+
+        contents = []
+        with patch('posts.views.index_feed', slow_feed):
+            threads = [
+                Thread(target=visit, args=(contents,)) for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(len(contents), 8)
+        # Запросы ленты выполнил только один поток, остальные получили
+        # прежнюю страницу.
+        self.assertEqual(len(feed_queries), 1)
+        self.assertEqual(
+            sum('Новый пост' in content.decode() for content in contents), 1)
+        self.assertIn('Новый пост', Client().get(url).content.decode())
+
+    def test_waiter_builds_after_failed_build(self):
+        """Check the waiters do not stall when the builder stores nothing."""
+        cache.clear()
+        cache.add('lock:failed', 1, settings.CACHE_LOCK_TIMEOUT)
+
+        def failed_build():
+            # Построивший страницу поток получил 404 и снял блокировку.
+            sleep(0.2)
+            cache.delete('lock:failed')
+
+        builder = Thread(target=failed_build)
+        builder.start()
+        start = monotonic()
+        content = single_flight('failed', 'stamp', 60, lambda: 'Страница')
+        builder.join()
+        self.assertEqual(content, 'Страница')
+        self.assertLess(monotonic() - start, settings.CACHE_LOCK_TIMEOUT / 2)
+
+
+class SQLiteTransactionsTestCase(TransactionTestCase):
+
+    def test_connection_pragmas(self):
+        """Check the new connection gets settings.SQLITE_PRAGMAS."""
+        with connection.cursor() as cursor:
+            for name in ('busy_timeout', 'cache_size'):
+                with self.subTest(pragma=name):
+                    cursor.execute(f'PRAGMA {name}')
+                    self.assertEqual(
+                        cursor.fetchone()[0], settings.SQLITE_PRAGMAS[name])
+
+    def test_write_request_takes_write_lock(self):
+        """Check only the unsafe request starts with BEGIN IMMEDIATE."""
+        user = User.objects.create(username='writer')
+        post = Post.objects.create(text='Пост', author=user)
+        client = Client()
+        client.force_login(user)
+        url = reverse(
+            'add_comment',
+            kwargs={'username': user.username, 'post_id': post.pk},
+        )
+        for method, begin in (('get', 'BEGIN'), ('post', 'BEGIN IMMEDIATE')):
+            with self.subTest(method=method):
+                with CaptureQueriesContext(connection) as queries:
+                    getattr(client, method)(url, {'text': 'Комментарий'})
+                self.assertIn(
+                    begin,
+                    [query['sql'] for query in queries.captured_queries],
+                )
+        self.assertFalse(connection.begin_immediate)
+
+    def test_release_checks_posts_under_write_lock(self):
+        """Check the released image is looked up holding the write lock."""
+        name = 'posts/ab/' + 'a' * 64 + '.jpg'
+        with CaptureQueriesContext(connection) as queries:
+            with patch('posts.thumbnails.delete') as delete:
+                release(name)
+        sql = [query['sql'] for query in queries.captured_queries]
+        self.assertEqual(sql[0], 'BEGIN IMMEDIATE')
+        self.assertIn('"posts_post"."image" =', sql[1])
+        delete.assert_called_once_with(name)
+        self.assertFalse(connection.begin_immediate)
+
+
+@override_settings(
+    CACHES={'default': {
+        'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}},
+    LOCAL_CACHE_SIZE=0,
+)
+class ReplicaRouterTestCase(TransactionTestCase):
+
+    def setUp(self):
+        # Вторая SQLite-база в файле изображает реплику.
+        directory = TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        connections.settings['replica'] = {
+            **connections['default'].settings_dict,
+            'NAME': str(Path(directory.name) / 'replica.sqlite3'),
+            'ATOMIC_REQUESTS': False,
+        }
+        self.addCleanup(self.remove_replica)
+        self.user = User.objects.create(username='writer')
+        self.post = Post.objects.create(text='Пост', author=self.user)
+        self.url = reverse('post', kwargs={
+            'username': self.user.username, 'post_id': self.post.pk})
+        # Страницы создают счётчики и статистику автора, пусть они уже
+        # будут на реплике.
+        Client().get(self.url)
+        Client().get(reverse('index'))
+        replicas = override_settings(DATABASE_REPLICAS=['replica'])
+        replicas.enable()
+        self.addCleanup(replicas.disable)
+        call_command('sync_replicas', stdout=StringIO())
+
+    @staticmethod
+    def remove_replica():
+        connections['replica'].close()
+        del connections['replica']
+        del connections.settings['replica']
+
+    def test_reads_of_request_go_to_replica(self):
+        """Check only the reads of the unpinned request use the replica."""
+        Post.objects.create(text='Новый пост', author=self.user)
+        self.assertEqual(Post.objects.count(), 2)
+        for pinned, count in ((False, 1), (True, 2)):
+            with self.subTest(pinned=pinned):
+                start_request(pinned)
+                try:
+                    self.assertEqual(Post.objects.count(), count)
+                finally:
+                    finish_request()
+        start_request(False)
+        try:
+            Post.objects.filter(pk=self.post.pk).update(text='Правка')
+            # Запрос, который писал, дальше читает свою запись.
+            self.assertEqual(Post.objects.count(), 2)
+        finally:
+            self.assertTrue(finish_request())
+
+    @patch('posts.cache.recently_written', return_value=False)
+    def test_writer_reads_own_writes(self, recently_written):
+        """Check the writer stays on the primary for a while."""
+        writer, reader = Client(), Client()
+        writer.force_login(self.user)
+        response = writer.post(
+            reverse('add_comment', kwargs={
+                'username': self.user.username, 'post_id': self.post.pk}),
+            {'text': 'Свежий комментарий'},
+        )
+        self.assertIn(PRIMARY_COOKIE, response.cookies)
+        self.assertContains(writer.get(self.url), 'Свежий комментарий')
+        response = reader.get(self.url)
+        self.assertNotContains(response, 'Свежий комментарий')
+        self.assertNotIn(PRIMARY_COOKIE, response.cookies)
+        with patch('posts.middleware.time',
+                   return_value=time() + settings.READ_YOUR_WRITES_TTL):
+            self.assertNotContains(writer.get(self.url), 'Свежий комментарий')
+
+    def test_lazy_counters_do_not_pin_reader(self):
+        """Check the counters created by a page view pin nobody."""
+        Counter.objects.all().delete()
+        response = Client().get(reverse('index'))
+        self.assertTrue(Counter.objects.exists())
+        self.assertNotIn(PRIMARY_COOKIE, response.cookies)
+
+    def test_follower_reads_own_follow(self):
+        """Check the follow pins the follower and shows on the profile."""
+        reader = User.objects.create(username='reader')
+        call_command('sync_replicas', stdout=StringIO())
+        client = Client()
+        client.force_login(reader)
+        response = client.get(reverse(
+            'profile_follow', kwargs={'username': self.user.username}))
+        self.assertIn(PRIMARY_COOKIE, response.cookies)
+        response = client.get(response.url)
+        self.assertTrue(response.context['following'])
+        self.assertEqual(response.context['stats'].followers, 1)
+
+    def test_written_pages_are_cached_from_primary(self):
+        """Check the cached page of the recent write skips the replica."""
+        Post.objects.create(text='Новый пост', author=self.user)
+        url = reverse('index')
+        with patch('posts.cache.recently_written', return_value=False):
+            self.assertNotContains(Client().get(url), 'Новый пост')
+        self.assertContains(Client().get(url), 'Новый пост')
 
 
 class FollowTestCase(BaseTestCase):
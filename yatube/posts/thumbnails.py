@@ -0,0 +1,216 @@
+"""Thumbnails of the post images made ahead of the page render.
+
+A post with a new image is saved with thumbnails_ready off and the cards
+show a placeholder. The worker (manage.py warm_thumbnails --watch) picks
+such posts up, makes the thumbnails, marks the posts and rebuilds their
+cards, so the render only looks the thumbnails up in the sorl key-value
+store. With settings.THUMBNAIL_ASYNC off the thumbnails are made right in
+the request, like before.
+
+All thumbnails are remade by the regenerate_thumbnails command: the pool of
+processes makes the files and collects the sorl key-value items in memory
+(make_thumbnails), the command writes them by a few queries (store_items).
+"""
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from sorl.thumbnail import default, delete, get_thumbnail
+from sorl.thumbnail.conf import settings as sorl_settings
+from sorl.thumbnail.helpers import deserialize, serialize
+from sorl.thumbnail.images import ImageFile
+from sorl.thumbnail.kvstores.base import KVStoreBase
+from sorl.thumbnail.models import KVStore
+
+from . import cache, routers
+from .db_backend import write_transaction
+from .models import Post
+from .storage import is_addressed
+
+# The card image is cropped to 960x339 and made in several widths and
+# formats; the browser picks one by the srcset and sizes of the <picture>.
+WIDTHS = (480, 960, 1440)
+RATIO = 339 / 960
+# The order of the <source>s; the last format is the <img> fallback.
+FORMATS = ('WEBP', 'JPEG')
+FALLBACK_WIDTH = 960
+# Width of the card in the nested containers of templates/base.html.
+SIZES = ('(min-width: 1200px) 1110px, (min-width: 992px) 930px, '
+         '(min-width: 768px) 690px, 100vw')
+
+
+def pending():
+    """Return the posts waiting for the thumbnails, oldest first."""
+    return Post.objects.filter(thumbnails_ready=False).exclude(
+        image='').exclude(image=None).order_by('pub_date')
+
+
+def make_variants(image):
+    """Make all thumbnails of the image and return their metadata.
+
+    The metadata is {format: [[name, width, height], ...]} by width, it is
+    stored in Post.image_variants, so the render neither opens the files
+    nor looks them up in the sorl key-value store. OSError is raised for
+    the image which can not be read.
+    """
+    variants = {}
+    for image_format in FORMATS:
+        variants[image_format.lower()] = thumbnails = []
+        for width in WIDTHS:
+            thumbnail = get_thumbnail(
+                image,
+                f'{width}x{round(width * RATIO)}',
+                crop='center',
+                upscale=True,
+                format=image_format,
+            )
+            # sorl logs the error of the source and returns the thumbnail
+            # which has not been made.
+            if thumbnail.size is None:
+                raise OSError(f'The image {image} can not be read')
+            thumbnails.append(
+                [thumbnail.name, thumbnail.width, thumbnail.height])
+    return variants
+
+
+def generate(post):
+    """Make all thumbnails of the post image and mark the post.
+
+    The post is not marked if its image has been replaced meanwhile.
+    """
+    variants = make_variants(post.image)
+    marked = Post.objects.filter(pk=post.pk, image=post.image.name).update(
+        thumbnails_ready=True, image_variants=variants)
+    if marked:
+        post.thumbnails_ready = True
+        post.image_variants = variants
+        cache.invalidate(cache.post_scopes(
+            post.pk,
+            post.author.username,
+            post.group.slug if post.group_id else None,
+        ))
+    return bool(marked)
+
+
+def release(name):
+    """Delete the image and its thumbnails unless a post still refers to it.
+
+    Only the images named by the content are shared by the posts and
+    deleted, see posts.storage; the older ones are left to dedupe_images.
+    """
+    if name and is_addressed(name):
+        collect(name)
+
+
+def collect(name):
+    """Delete the image and its thumbnails if no post refers to it.
+
+    The check and the deletion hold the write lock of the database. An
+    upload looks the stored file up under the lock of its request
+    (posts.middleware.write_lock), so no post starts referring to the file
+    in between. Return whether the image has been deleted.
+    """
+    with routers.primary(), write_transaction():
+        if Post.objects.filter(image=name).exists():
+            return False
+        delete(name)
+    return True
+
+
+def schedule(post):
+    """Hand the new image of the saved post over to the worker."""
+    if not settings.THUMBNAIL_ASYNC:
+        generate(post)
+
+
+class MemoryKVStore(KVStoreBase):
+    """sorl key-value store collecting the raw items in a dict."""
+
+    def __init__(self):
+        super().__init__()
+        self.items = {}
+
+    def _get_raw(self, key):
+        return self.items.get(key)
+
+    def _set_raw(self, key, value):
+        self.items[key] = value
+
+    def _delete_raw(self, *keys):
+        for key in keys:
+            self.items.pop(key, None)
+
+    def _find_keys_raw(self, prefix):
+        return [key for key in self.items if key.startswith(prefix)]
+
+
+def collect_items():
+    """Make sorl of this process keep its key-value items in memory.
+
+    It is the initializer of the processes of the pool.
+    """
+    default.kvstore._wrapped = MemoryKVStore()
+
+
+def make_thumbnails(images, force=False):
+    """Make the thumbnails of the images of {pk: name}.
+
+    Return the sorl items, the variants of every pk and the errors of the
+    images which could not be read. The existing thumbnail files are kept
+    unless force is set, then they are deleted and made again.
+    """
+    kvstore = default.kvstore
+    kvstore.items.clear()
+    variants, errors = {}, {}
+    for pk, name in images.items():
+        try:
+            if force:
+                # The first pass only lists the existing thumbnails.
+                make_variants(name)
+                kvstore.delete_thumbnails(ImageFile(name))
+            variants[pk] = make_variants(name)
+        except OSError as error:
+            errors[pk] = str(error)
+    return dict(kvstore.items), variants, errors
+
+
+def store_items(items):
+    """Write the raw sorl key-value items to the store by a few queries.
+
+    The lists of the thumbnails of the sources are merged with the stored
+    ones, since the old thumbnails are still on the disk.
+    """
+    stored = dict(KVStore.objects.filter(key__in=items).values_list(
+        'key', 'value'))
+    items = dict(items)
+    for key, value in items.items():
+        if '||thumbnails||' in key and key in stored:
+            items[key] = serialize(sorted(
+                set(deserialize(value)) | set(deserialize(stored[key]))))
+    with transaction.atomic():
+        KVStore.objects.filter(key__in=items).delete()
+        KVStore.objects.bulk_create(
+            KVStore(key=key, value=value) for key, value in items.items())
+    caches[sorl_settings.THUMBNAIL_CACHE].set_many(
+        items, sorl_settings.THUMBNAIL_CACHE_TIMEOUT)
+
+
+def mark_ready(variants):
+    """Store the variants of {pk: variants} and mark the posts.
+
+    Only the posts which change are written and get their cards rebuilt.
+    """
+    changed = [
+        (pk, username, slug)
+        for pk, username, slug, ready, stored in Post.objects.filter(
+            pk__in=variants).values_list(
+            'pk', 'author__username', 'group__slug', 'thumbnails_ready',
+            'image_variants')
+        if not ready or stored != variants[pk]
+    ]
+    Post.objects.bulk_update(
+        [Post(pk=pk, thumbnails_ready=True, image_variants=variants[pk])
+         for pk, _, _ in changed],
+        ('thumbnails_ready', 'image_variants'),
+    )
+    for names in changed:
+        cache.invalidate(cache.post_scopes(*names))
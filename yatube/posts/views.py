@@ -2,39 +2,56 @@ from http import HTTPStatus
 
 from django.contrib.auth.decorators import login_required
 from django.shortcuts import get_object_or_404, redirect, render
-from django.views.decorators.cache import cache_page
 from django.views.decorators.http import require_http_methods, require_POST
-from django.views.decorators.vary import vary_on_cookie
 from django.conf import settings
+from django.db import router
 
+from .cache import cache_shared_page, cached_object, conditional_page
+from .counters import POSTS, STATS_FIELDS, author_stats, counter_name
+from .feeds import (author_feed, follow_counter, follow_feed, group_feed,
+                    index_feed, post_comments)
 from .forms import CommentForm, PostForm
-from .models import Comment, Follow, Group, Post, User
+from .models import AuthorStats, Comment, Follow, Group, Post, User
 from .paginator import my_paginator
+from .search import SearchResults
 
 
-@cache_page(settings.CACHE_TTL, key_prefix='index_page')
-@vary_on_cookie
+@conditional_page(['feed'])
+@cache_shared_page(settings.CACHE_TTL, key_prefix='index_page')
 def index(request):
     """Return page with settings.MAX_PAGE_COUNT posts."""
-    post_list = Post.objects.select_related(
-        'author',
-        'group',
-    ).prefetch_related(
-        'comments',
-    )
+    post_list = index_feed()
     context = my_paginator(
         post_list,
         request.GET.get('page'),
+        after=request.GET.get('after'),
+        before=request.GET.get('before'),
+        counter=POSTS,
     )
     return render(request, 'posts/index.html', context)
 
 
+@conditional_page(lambda request, slug: [f'group:{slug}'])
+@cache_shared_page(
+    settings.CACHE_TTL,
+    key_prefix='group_page',
+    scopes=lambda request, slug: [f'group:{slug}'],
+)
 def group_posts(request, slug):
     """Return several (settings.MAX_PAGE_COUNT) posts in the selected group."""
-    group = get_object_or_404(Group, slug=slug)
-    post_list = group.posts.select_related('author').prefetch_related(
-        'comments')
-    paginator = my_paginator(post_list, request.GET.get('page'))
+    group = cached_object(
+        f'group:{slug}',
+        f'object:group:{slug}',
+        lambda: get_object_or_404(Group, slug=slug),
+    )
+    post_list = group_feed(group)
+    paginator = my_paginator(
+        post_list,
+        request.GET.get('page'),
+        after=request.GET.get('after'),
+        before=request.GET.get('before'),
+        counter=counter_name('group', group.pk),
+    )
     context = {
         **paginator,
         'group': group,
@@ -42,26 +59,94 @@ def group_posts(request, slug):
     return render(request, 'posts/group.html', context)
 
 
+def search(request):
+    """Return the page of the posts matching the query, the best first."""
+    query = request.GET.get('q', '').strip()
+    context = {
+        **my_paginator(
+            SearchResults(query), request.GET.get('page'), numbered=True),
+        'query': query,
+    }
+    return render(request, 'posts/search.html', context)
+
+
+AUTHOR_FIELDS = ('id', 'username', 'first_name', 'last_name')
+
+
+def load_author(username):
+    """Return the fields of the author and the stats to be kept in the cache.
+
+    Only the fields shown on the profile are cached, not the password hash
+    and the email.
+    """
+    user = get_object_or_404(
+        User.objects.select_related('stats'),
+        username=username,
+    )
+    stats = author_stats(user)
+    return {
+        'user': {field: getattr(user, field) for field in AUTHOR_FIELDS},
+        'stats': {field: getattr(stats, field) for field in STATS_FIELDS},
+    }
+
+
+def cached_author(username):
+    """Return the author of the profile with the stats from the cache.
+
+    The other fields of the user are deferred like by only().
+    """
+    fields = cached_object(
+        f'author:{username}',
+        f'object:author:{username}',
+        lambda: load_author(username),
+    )
+    db = router.db_for_read(User)
+    user = User.from_db(db, *zip(*fields['user'].items()))
+    user.stats = AuthorStats.from_db(
+        db, ('user_id', *STATS_FIELDS),
+        (user.pk, *(fields['stats'][field] for field in STATS_FIELDS)))
+    return user
+
+
+@conditional_page(lambda request, username: [f'author:{username}'])
 def profile(request, username):
     """Shows user profile"""
-    user = get_object_or_404(User, username=username)
-    post_list = user.posts.select_related('group').prefetch_related('comments')
-    paginator = my_paginator(post_list, request.GET.get('page'))
+    user = cached_author(username)
+    post_list = author_feed(user)
+    paginator = my_paginator(
+        post_list,
+        request.GET.get('page'),
+        after=request.GET.get('after'),
+        before=request.GET.get('before'),
+        counter=counter_name('author', user.pk),
+    )
     following = request.user.is_authenticated and request.user.follower.filter(
         author=user).exists()
     context = {
         **paginator,
         'author': user,
+        'stats': author_stats(user),
         'following': following,
     }
     return render(request, 'posts/profile.html', context)
 
 
+@conditional_page(lambda request, username, post_id: [
+    f'post:{post_id}', f'author:{username}'])
 def post_view(request, username, post_id):
     """Shows the selected post."""
-    post = get_object_or_404(Post, pk=post_id, author__username=username)
+    post = get_object_or_404(
+        Post.objects.select_related('author__stats', 'group'),
+        pk=post_id,
+        author__username=username,
+    )
     form = CommentForm()
-    context = {'form': form, 'post': post}
+    context = {
+        'form': form,
+        'post': post,
+        'stats': author_stats(post.author),
+        'comments': post_comments(post),
+    }
     return render(request, 'posts/post.html', context)
 
 
@@ -157,12 +242,13 @@ def server_error(request):
 @login_required
 def follow_index(request):
     """Return a page with posts by subscribed authors."""
-    post_list = Post.objects.filter(
-        author__following__user=request.user
-    ).select_related('author', 'group').prefetch_related('comments')
+    post_list = follow_feed(request.user)
     context = my_paginator(
         post_list,
         request.GET.get('page'),
+        after=request.GET.get('after'),
+        before=request.GET.get('before'),
+        counter=follow_counter(request.user),
     )
     return render(request, 'posts/follow.html', context)
 
@@ -1,3 +1,4 @@
+import sys
 from os import getenv
 
 from dotenv import load_dotenv
@@ -8,6 +9,8 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 load_dotenv(BASE_DIR / '.env')
 
 DEBUG = getenv('DEBUG') == 'True'
+# 'manage.py test' and pytest run against the settings of the server.
+TESTING = sys.argv[1:2] == ['test'] or 'pytest' in sys.modules
 SECRET_KEY = getenv('SECRET_KEY')
 ALLOWED_HOSTS = [*map(lambda host: host.strip(' ,\t\n\r'), getenv('ALLOWED_HOSTS').split(','))]
 
@@ -33,12 +36,14 @@ INSTALLED_APPS = [
 MIDDLEWARE = [
     *(['debug_toolbar.middleware.DebugToolbarMiddleware'] if DEBUG else []),
     'django.middleware.security.SecurityMiddleware',
+    'posts.middleware.read_your_writes',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'posts.middleware.write_lock',
 ]
 
 ROOT_URLCONF = 'yatube.urls'
@@ -66,10 +71,39 @@ WSGI_APPLICATION = 'yatube.wsgi.application'
 
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
+        'ENGINE': 'posts.db_backend',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'ATOMIC_REQUESTS': True,
+        'CONN_MAX_AGE': int(getenv('CONN_MAX_AGE', 600)),
     }
 }
+# Read-only copies of the default database by posts.routers, e.g.
+# DATABASE_REPLICAS=replica.sqlite3; the local SQLite copies are updated by
+# 'manage.py sync_replicas'.
+DATABASE_REPLICAS = []
+for number, name in enumerate(
+        filter(None, getenv('DATABASE_REPLICAS', '').split(','))):
+    DATABASES[f'replica_{number}'] = {
+        **DATABASES['default'],
+        'NAME': BASE_DIR / name.strip(),
+        'ATOMIC_REQUESTS': False,
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_REPLICAS.append(f'replica_{number}')
+DATABASE_ROUTERS = ['posts.routers.ReplicaRouter']
+# The reads of the user stay on the default database after a write.
+READ_YOUR_WRITES_TTL = 5
+# Set on every new SQLite connection by posts.signals.tune_sqlite: readers
+# do not wait for the writer in WAL mode, the writer waits for the lock
+# instead of failing at once.
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,
+    'cache_size': -64000,
+    'mmap_size': 256 * 1024 * 1024,
+    'temp_store': 'MEMORY',
+}
 
 AUTH_PASSWORD_VALIDATORS = [
     {'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator'},
@@ -96,6 +130,9 @@ STATIC_ROOT = BASE_DIR / 'static'
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
+# The uploads are named by their content, the thumbnails by sorl.
+DEFAULT_FILE_STORAGE = 'posts.storage.ContentAddressedStorage'
+THUMBNAIL_STORAGE = 'django.core.files.storage.FileSystemStorage'
 
 LOGIN_URL = '/auth/login/'
 LOGIN_REDIRECT_URL = 'index'
@@ -105,10 +142,49 @@ EMAIL_FILE_PATH = BASE_DIR / 'sent_emails'
 
 MAX_PAGE_COUNT = 10
 DELTA_PAGE_COUNT = 1 if DEBUG else 5
+CURSOR_PAGINATION = getenv('CURSOR_PAGINATION') == 'True'
+FEED_FANOUT_BATCH = 1000
+FEED_BACKFILL_COUNT = 1000
+FOLLOW_FEED_ENGINE = getenv('FOLLOW_FEED_ENGINE', 'timeline')
+FEED_AUTHOR_CACHE_SIZE = 200
+FEED_AUTHOR_CACHE_TTL = 60 * 60 * 24
 
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        # The file cache is shared by all workers of the server. The
+        # development server and the tests use the local memory one, so the
+        # tests never read or clear the cache file of a running server.
+        'BACKEND': (
+            'django.core.cache.backends.locmem.LocMemCache'
+            if DEBUG or TESTING
+            else 'posts.cache_backend.SQLiteCache'
+        ),
+        'LOCATION': getenv('CACHE_LOCATION', BASE_DIR / 'cache.sqlite3'),
+        'OPTIONS': {'MAX_ENTRIES': 10000},
     }
 }
-CACHE_TTL = 20
+CACHE_TTL = 60 * 60 * 12
+CACHE_STALE_TTL = 60 * 60
+CACHE_LOCK_TIMEOUT = 10
+CACHE_EARLY_RECOMPUTE = float(getenv('CACHE_EARLY_RECOMPUTE', 1))
+LOCAL_CACHE_SIZE = 1000
+LOCAL_CACHE_TTL = 60
+LOCAL_VERSION_TTL = 1
+PAGE_STATS_FLUSH_INTERVAL = 10
+# The thumbnails are made by 'manage.py warm_thumbnails --watch'.
+THUMBNAIL_ASYNC = getenv('THUMBNAIL_ASYNC', str(not DEBUG)) == 'True'
+THUMBNAIL_BATCH = 100
+THUMBNAIL_POLL_INTERVAL = 1
+# The uploads are checked by the size from the header and stored reduced
+# to IMAGE_MAX_SIZE; only the images of IMAGE_MAX_DECODED_PIXELS are
+# decoded in full, JPEG is decoded at a smaller scale.
+IMAGE_MAX_PIXELS = 64_000_000
+IMAGE_MAX_DECODED_PIXELS = 16_000_000
+IMAGE_MAX_SIZE = 2560
+IMAGE_QUALITY = 85
+# The search shows the SEARCH_MAX_RESULTS best posts at most.
+SEARCH_MAX_RESULTS = 1000
+SEARCH_MAX_WORDS = 10
+# The admin change lists count ADMIN_COUNT_LIMIT rows at most.
+ADMIN_COUNT_LIMIT = 10000
+ADMIN_TEXT_LENGTH = 80